@@ -0,0 +1,214 @@
+import argparse
+import json
+import time
+from tm.TransManager import TransactionManager, DEADLOCK_POLICIES, PROTOCOLS, ISOLATION_LEVELS
+from tm.output import NullSink
+from tm.checker import Checker, pinned
+from tm.scheduler import Scheduler
+from main import commandParser, fileReader
+from bench.workload import add_workload_arguments, workload_from_args
+
+
+class Timer():
+    """
+    accumulate the time spent in a function
+    input: name, function
+    output: wrapped function
+    side effect: None
+    """
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.calls += 1
+
+
+class OutcomeSink(NullSink):
+    """
+    output sink that only keeps the last outcome of every transaction
+    """
+    def __init__(self):
+        self.outcome = dict() #{<str:transid>:True(committed)/False(aborted)}
+        self.deadlocks = 0    #aborts of deadlock victims
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        self.outcome[trans_id] = True
+
+    def aborted(self, trans_id, cause):
+        if cause == "deadlock" and trans_id not in self.outcome:
+            self.deadlocks += 1
+        self.outcome[trans_id] = False
+
+
+def closed_loop(workload, **options):
+    """
+    generate a workload closed loop: it runs on a TransactionManager while it is generated,
+    so a transaction that waits for a lock or a readable copy gets no operation until it resumes;
+    the TransactionManager is deterministic, the commands run the same way again when timed
+    input: WorkloadGenerator, TransactionManager options(the ones the benchmark uses)
+    output: list of parsed commands
+    side effect: None
+    """
+    tm = TransactionManager(output=NullSink(), **options)
+    workload.blocked = tm.blocked
+    commands = []
+    for line in workload:
+        records = commandParser(line)
+        tm.loadCommand(records)
+        commands.extend(records)
+    tm.close()
+    return commands
+
+def run_benchmark(commands, num_sites=10, num_vars=20, deadlock="detect", protocol="available-copies",
+                  read_quorum=0, write_quorum=0, catch_up=0, isolation="2pl", check=False,
+                  max_hot=0):
+    """
+    feed commands to a fresh TransactionManager and time it
+    input: iterator of parsed commands, number of sites, number of variables, deadlock policy,
+        replication protocol, quorum sizes, copies caught up per command after a recovery,
+        isolation of read-write transactions, whether to check the history while it runs(see tm.checker),
+        most read-write transactions on hot variables admitted by the scheduler(see tm.scheduler, 0 for none)
+    output: dict of results
+    side effect: None
+    """
+    out = OutcomeSink()
+    checker = Checker(out) if check else None
+    tm = TransactionManager(num_sites, num_vars, output=out if checker is None else checker,
+                            deadlock=deadlock, protocol=protocol,
+                            read_quorum=read_quorum, write_quorum=write_quorum, catch_up=catch_up,
+                            isolation=isolation)
+    timers = [Timer("detect_deadlock", tm.detect_deadlock), Timer("prevent_deadlock", tm.prevent_deadlock),
+              Timer("end", tm.end)]
+    tm.detect_deadlock = timers[0]
+    tm.prevent_deadlock = timers[1]
+    tm.end = timers[2]
+    tm.locks.lock = Timer("LockTable.lock", tm.locks.lock)
+    commands = list(commands)
+    scheduler = None
+    if max_hot > 0:
+        scheduler = Scheduler(tm, commands, max_hot)
+    start = time.perf_counter()
+    tm.loadCommand(commands if scheduler is None else scheduler)
+    elapsed = time.perf_counter() - start
+    timers.insert(1, tm.locks.lock)
+    commits = sum(1 for v in out.outcome.values() if v)
+    aborts = len(out.outcome) - commits
+    result = {
+        "deadlock": deadlock,
+        "protocol": protocol,
+        "isolation": isolation,
+        "max_hot": max_hot,
+        "commands": len(commands),
+        "seconds": elapsed,
+        "ops_per_sec": len(commands) / elapsed if elapsed > 0 else 0.0,
+        "commits": commits,
+        "aborts": aborts,
+        "commit_rate": commits / len(out.outcome) if len(out.outcome) > 0 else 0.0,
+        "abort_rate": aborts / len(out.outcome) if len(out.outcome) > 0 else 0.0,
+        "deadlocks": out.deadlocks,
+        "commits_per_sec": commits / elapsed if elapsed > 0 else 0.0,
+        "timers": {t.name: {"calls": t.calls, "seconds": t.seconds} for t in timers},
+    }
+    if scheduler is not None:
+        result["queued"] = scheduler.num_queued
+        result["max_queue"] = scheduler.max_queue
+    if checker is not None:
+        result["check"] = checker.summary()
+    return result
+
+def report(result):
+    """
+    print benchmark results
+    input: dict of results
+    output: None
+    side effect: results printed
+    """
+    print("deadlock:   {}".format(result["deadlock"]))
+    print("protocol:   {}".format(result["protocol"]))
+    print("isolation:  {}".format(result["isolation"]))
+    print("commands:   {}".format(result["commands"]))
+    print("seconds:    {:.4f}".format(result["seconds"]))
+    print("ops/sec:    {:.0f}".format(result["ops_per_sec"]))
+    print("commits:    {} ({:.1%})".format(result["commits"], result["commit_rate"]))
+    print("aborts:     {} ({:.1%})".format(result["aborts"], result["abort_rate"]))
+    print("deadlocks:  {}".format(result["deadlocks"]))
+    print("commits/s:  {:.0f}".format(result["commits_per_sec"]))
+    if "queued" in result:
+        print("queued:     {} begins, at most {} at once (max hot {})".format(
+            result["queued"], result["max_queue"], result["max_hot"]))
+    for name, t in result["timers"].items():
+        print("{:<16}{:>10} calls {:>10.4f} s".format(name, t["calls"], t["seconds"]))
+    if "check" in result:
+        check = result["check"]
+        print("violations: {} (at most {} graph nodes{})".format(check["violations"], check["peak_nodes"],
+                                                                 pinned(check)))
+        for message in check["messages"]:
+            print("  {}".format(message))
+
+
+def main():
+    description = "Benchmark the transaction manager"
+    parser = argparse.ArgumentParser(description=description)
+    add_workload_arguments(parser)
+    parser.add_argument('-f', '--file',
+			dest='test_file',
+			help='Benchmark a command file instead of a generated workload.')
+    parser.add_argument('--isolation',
+			dest='isolation', default='2pl', choices=ISOLATION_LEVELS,
+			help='Read-write transactions: two-phase locking, or snapshot isolation(first committer wins).')
+    parser.add_argument('--deadlock',
+			dest='deadlock', default='detect', choices=DEADLOCK_POLICIES,
+			help='Deadlock policy: detect cycles, wait-die or wound-wait.')
+    parser.add_argument('--protocol',
+			dest='protocol', default='available-copies', choices=PROTOCOLS,
+			help='Replication protocol: write all up copies, or read and write quorums.')
+    parser.add_argument('--read-quorum',
+			dest='read_quorum', type=int, default=0,
+			help='Copies read by a quorum read, 0 for the smallest one overlapping the write quorum.')
+    parser.add_argument('--write-quorum',
+			dest='write_quorum', type=int, default=0,
+			help='Copies written by a quorum write, 0 for a majority.')
+    parser.add_argument('--catch-up',
+			dest='catch_up', type=int, default=0,
+			help='Replicated copies of recovered sites copied from an up-to-date copy per command, 0 to wait for writes.')
+    parser.add_argument('--max-hot',
+			dest='max_hot', type=int, default=0,
+			help='Queue new read-write transactions while this many touch hot variables, 0 to admit all.')
+    parser.add_argument('--check',
+			dest='check', action='store_true',
+			help='Check that the history is serializable and follows available copies, the time is included.')
+    parser.add_argument('--json',
+			dest='json_file',
+			help='Also write the results to a json file.')
+    parser.add_argument('--open-loop',
+			dest='open_loop', action='store_true',
+			help='Give operations to transactions that are still waiting, as a generated file does.')
+    args = parser.parse_args()
+    if args.test_file is None and args.open_loop:
+        commands = (command for line in workload_from_args(args)
+                            for command in commandParser(line))
+    elif args.test_file is None:
+        commands = closed_loop(workload_from_args(args), num_sites=args.num_sites, num_vars=args.num_vars,
+                               deadlock=args.deadlock, protocol=args.protocol, read_quorum=args.read_quorum,
+                               write_quorum=args.write_quorum, catch_up=args.catch_up, isolation=args.isolation)
+    else:
+        commands = fileReader(args.test_file)
+    result = run_benchmark(commands, args.num_sites, args.num_vars, args.deadlock, args.protocol,
+                           args.read_quorum, args.write_quorum, args.catch_up, args.isolation, args.check,
+                           args.max_hot)
+    report(result)
+    if args.json_file is not None:
+        with open(args.json_file, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import bisect
+import itertools as it
+import random
+import sys
+
+
+class WorkloadGenerator():
+    """
+    synthetic workload generator, writes commands in the grammar read by main.py
+    open loop by default: the next operation of a transaction is written whether or not the
+    previous one is still waiting, and a later one replaces it; with blocked set(see
+    bench.benchmark.closed_loop) the transactions that wait get no operation
+    input: workload knobs, see __init__
+    output: command line iterator
+    side effect: None
+    """
+    def __init__(self, transactions=1000, ops=5, write_ratio=0.5, ro_ratio=0.1,
+                 skew=0.0, fail_rate=0.0, concurrency=10, num_sites=10, num_vars=20, seed=0):
+        """
+        input: number of transactions, operations per transaction, fraction of writes in
+            read-write transactions, fraction of read-only transactions, zipfian skew of
+            variable access(0 is uniform), probability of a fail/recover per command,
+            number of transactions running at the same time, number of sites,
+            number of variables, random seed
+        """
+        self.transactions = transactions
+        self.ops = ops
+        self.write_ratio = write_ratio
+        self.ro_ratio = ro_ratio
+        self.fail_rate = fail_rate
+        self.concurrency = concurrency
+        self.num_sites = num_sites
+        self.num_vars = num_vars
+        self.seed = seed
+        self.blocked = None #predicate on trans ids, True while the transaction waits
+        #cumulative zipfian weights, variable x(k+1) has weight 1/(k+1)^skew
+        self.cum_weights = list(it.accumulate(1.0 / (k ** skew) for k in range(1, num_vars+1)))
+
+    def pick_var(self, rand):
+        """
+        pick a variable following the zipfian distribution
+        input: random generator
+        output: variable
+        side effect: None
+        """
+        x = rand.random() * self.cum_weights[-1]
+        return min(bisect.bisect_right(self.cum_weights, x), self.num_vars - 1) + 1
+
+    def pick_trans(self, rand, active):
+        """
+        pick the running transaction that gets the next operation
+        input: random generator, [[trans id, read only, remaining ops]]
+        output: index in active
+        side effect: a waiting transaction picked because all of them wait has no ops left
+        """
+        if self.blocked is None:
+            return rand.randrange(len(active))
+        ready = [idx for idx, trans in enumerate(active) if not self.blocked(trans[0])]
+        if len(ready) == 0:
+            #lock waits always leave one transaction running, so they all wait for readable
+            #copies nobody writes: the first one gives up and ends
+            active[0][2] = 0
+            return 0
+        return ready[rand.randrange(len(ready))]
+
+    def __iter__(self):
+        rand = random.Random(self.seed)
+        active = [] #[[trans id, read only, remaining ops]]
+        down = set()
+        begun = 0
+        while begun < self.transactions or len(active) > 0:
+            if self.fail_rate > 0 and rand.random() < self.fail_rate:
+                site = rand.randint(1, self.num_sites)
+                if site in down:
+                    down.remove(site)
+                    yield "recover({})".format(site)
+                else:
+                    down.add(site)
+                    yield "fail({})".format(site)
+                continue
+            if begun < self.transactions and len(active) < self.concurrency:
+                begun += 1
+                ro = rand.random() < self.ro_ratio
+                active.append(["T{}".format(begun), ro, rand.randint(1, 2*self.ops - 1)])
+                if ro:
+                    yield "beginRO(T{})".format(begun)
+                else:
+                    yield "begin(T{})".format(begun)
+                continue
+            idx = self.pick_trans(rand, active)
+            trans = active[idx]
+            if trans[2] == 0:
+                active[idx] = active[-1]
+                active.pop()
+                yield "end({})".format(trans[0])
+                continue
+            trans[2] -= 1
+            var = self.pick_var(rand)
+            if not trans[1] and rand.random() < self.write_ratio:
+                yield "W({},x{},{})".format(trans[0], var, rand.randint(0, 9999))
+            else:
+                yield "R({},x{})".format(trans[0], var)
+        for site in sorted(down):
+            yield "recover({})".format(site)
+
+
+def add_workload_arguments(parser):
+    """
+    add the workload knobs to an argument parser
+    input: argparse parser
+    output: None
+    side effect: parser gets the workload options
+    """
+    parser.add_argument('-n', '--transactions', type=int, default=1000,
+			help='Number of transactions.')
+    parser.add_argument('--ops', type=int, default=5,
+			help='Average number of operations per transaction.')
+    parser.add_argument('--write-ratio', type=float, default=0.5,
+			help='Fraction of writes in read-write transactions.')
+    parser.add_argument('--ro-ratio', type=float, default=0.1,
+			help='Fraction of read-only transactions.')
+    parser.add_argument('--skew', type=float, default=0.0,
+			help='Zipfian skew of variable access, 0 is uniform.')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+			help='Probability of a site fail/recover per command.')
+    parser.add_argument('--concurrency', type=int, default=10,
+			help='Number of transactions running at the same time.')
+    parser.add_argument('--sites', dest='num_sites', type=int, default=10,
+			help='Number of sites.')
+    parser.add_argument('--variables', dest='num_vars', type=int, default=20,
+			help='Number of variables.')
+    parser.add_argument('--seed', type=int, default=0,
+			help='Random seed.')
+
+def workload_from_args(args):
+    """
+    build a generator from parsed arguments
+    input: parsed arguments
+    output: WorkloadGenerator
+    side effect: None
+    """
+    return WorkloadGenerator(args.transactions, args.ops, args.write_ratio, args.ro_ratio,
+                             args.skew, args.fail_rate, args.concurrency,
+                             args.num_sites, args.num_vars, args.seed)
+
+
+def main():
+    description = "Generate a synthetic workload"
+    parser = argparse.ArgumentParser(description=description)
+    add_workload_arguments(parser)
+    parser.add_argument('-o', '--output',
+			dest='output',
+			help='Path to output file, stdout by default.')
+    args = parser.parse_args()
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    for line in workload_from_args(args):
+        out.write(line + "\n")
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__=='__main__':
+    main()
@@ -1,55 +1,96 @@
-from tm.TransManager import TransactionManager
+from tm.TransManager import TransactionManager, DEADLOCK_POLICIES, PROTOCOLS, ISOLATION_LEVELS
+from sites.placement import RULES
+from sites.replica import SELECTIONS
+from tm.output import SINKS
+from tm.checker import Checker
+from tm.scheduler import Scheduler
+from tm.wal import CommitLog
+from trans.trace import recorder, traceReader
+from trans.op import OPCODES, READ, WRITE, FAIL, RECOVER, DUMP, INT64_MIN, INT64_MAX, ID_MAX
 import argparse
-import itertools as it 
-import os
+import json
 import sys
 import re
 
+COMMAND_RE = re.compile(r"([a-zA-Z0-9]+)\(([^)]*)\)")
+
+def compileInt(text, low, high, name):
+    """
+    decode an integer argument of a command
+    input: argument string, smallest and largest value allowed, name for the error
+    output: int
+    side effect: None
+    """
+    value = int(text)
+    if not low <= value <= high:
+        raise ValueError(
+            "{} {} out of range from command.".format(name, text))
+    return value
+
+def compileCommand(operation, args):
+    """
+    decode a command into an op record
+    input: operation name, list of argument strings
+    output: tuple (opcode, trans id, variable, value), see trans.op
+    side effect: None
+    """
+    opcode = OPCODES.get(operation)
+    if opcode is None:
+        raise ValueError(
+            "Cannot identify operation {} from command".format(operation))
+    if opcode == READ:
+        if len(args) != 2:
+            raise ValueError(
+                "Not enough args for read.")
+        return (opcode, args[0], compileInt(args[1][1:], 0, ID_MAX, "Variable"), None)
+    if opcode == WRITE:
+        if len(args) != 3:
+            raise ValueError(
+                "Not enough args for write.")
+        return (opcode, args[0], compileInt(args[1][1:], 0, ID_MAX, "Variable"),
+                compileInt(args[2], INT64_MIN, INT64_MAX, "Value"))
+    if opcode == FAIL or opcode == RECOVER:
+        return (opcode, None, None, compileInt(args[0], 0, ID_MAX, "Site"))
+    if opcode == DUMP:
+        return (opcode, None, None, None)
+    return (opcode, args[0], None, None)
+
 def commandParser(line):
     """
-    parse the command into a tuple (operator, [args..])
+    parse a line into op records
     Author: Xinsen Lu
     input: line of the command
-    output: list of parsed command
+    output: list of op records, see compileCommand
     side effect: None
     """
     # ignore comments
-    if "//" in line:
-        return None
+    line = line.split("//", 1)[0]
     commandList = []
     for command in line.split(";"):
         # In case stdin input, it is better to have delimiter to identify different groups
-        match = re.match("([a-zA-Z0-9]+)\(([^)]*)\)", command.strip())
+        match = COMMAND_RE.match(command.strip())
         if match is not None:
             operation, args = match.groups()
-            operation = operation.strip()
-            argslist = args.split(",")
-            argslist = [item.strip() for item in argslist]
-            commandList.append((operation, argslist))
+            argslist = [item.strip() for item in args.split(",")]
+            commandList.append(compileCommand(operation.strip(), argslist))
     return commandList
 
-	
+
 class fileReader():
     """
-    file reader
+    file reader, parses the file lazily while commands are consumed
     Author: Xinsen Lu
     input: file path
-    output: command iterator
+    output: op record iterator
     side effect: None
     """
     def __init__(self, file):
         self._file = file
-        self._command = []
-        self.parse()
-    def parse(self):
-        with open(self._file, "r") as f:
-            for _, line in enumerate(f):
-                command = commandParser(line)
-                if command is not None:
-                    self._command.extend(command)
-    
+
     def __iter__(self):
-        return iter(self._command)
+        with open(self._file, "r") as f:
+            for line in f:
+                yield from commandParser(line)
 
 
 
@@ -57,38 +98,166 @@ class streamReader():
     """
     stream reader
     Author: Xinsen Lu
-    input: Non
-    output: command iterator
+    input: stream, True to print each command line before its output
+    output: op record iterator
     side effect: None
     """
-    def __init__(self, stream):
+    def __init__(self, stream, echo=True):
         self._stream = stream
+        self._echo = echo
 
     def __iter__(self):
         for line in self._stream:
             commands = commandParser(line)
             if len(commands) > 0:
-                for command in commands:
-                    print(command)
-                    yield command
+                if self._echo:
+                    print(line.split("//", 1)[0].strip())
+                yield from commands
 
 
 
 
 
-def main():
+def make_parser():
+    """
+    build the command line parser of main.py, scenarios of regress.py use the same options
+    input: None
+    output: argparse parser
+    side effect: None
+    """
     description = "Advanced Database"   
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument('-f', '--file',
 			dest='test_file',
 			help='Path to file.')
-    args = parser.parse_args()
-    tm = TransactionManager()
-    if args.test_file is None:
-        commandIter = streamReader(sys.stdin)
+    parser.add_argument('--replay',
+			dest='trace_file',
+			help='Read the commands from a binary trace instead(see trans.trace).')
+    parser.add_argument('--record',
+			dest='record_file',
+			help='Also record the commands into a binary trace.')
+    parser.add_argument('--sites',
+			dest='num_sites', type=int, default=10,
+			help='Number of sites.')
+    parser.add_argument('--variables',
+			dest='num_vars', type=int, default=20,
+			help='Number of variables.')
+    parser.add_argument('--replication',
+			dest='replication', default='default', choices=sorted(RULES),
+			help='Which variables are stored in which sites.')
+    parser.add_argument('--replica-select',
+			dest='replica_selection', default='lowest', choices=sorted(SELECTIONS),
+			help='Which readable copy a replicated read goes to.')
+    parser.add_argument('--protocol',
+			dest='protocol', default='available-copies', choices=PROTOCOLS,
+			help='Replication protocol: write all up copies, or read and write quorums.')
+    parser.add_argument('--read-quorum',
+			dest='read_quorum', type=int, default=0,
+			help='Copies read by a quorum read, 0 for the smallest one overlapping the write quorum.')
+    parser.add_argument('--write-quorum',
+			dest='write_quorum', type=int, default=0,
+			help='Copies written by a quorum write, 0 for a majority.')
+    parser.add_argument('--catch-up',
+			dest='catch_up', type=int, default=0,
+			help='Replicated copies of recovered sites copied from an up-to-date copy per command, 0 to wait for writes.')
+    parser.add_argument('--isolation',
+			dest='isolation', default='2pl', choices=ISOLATION_LEVELS,
+			help='Read-write transactions: two-phase locking, or snapshot isolation(first committer wins).')
+    parser.add_argument('--history',
+			dest='history', type=int, default=None,
+			help='Most outcomes of finished transactions kept to reject reused transaction ids, all by default.')
+    parser.add_argument('--deadlock',
+			dest='deadlock', default='detect', choices=DEADLOCK_POLICIES,
+			help='Deadlock policy: detect cycles, wait-die or wound-wait.')
+    parser.add_argument('--wal',
+			dest='wal_dir',
+			help='Keep a commit log and snapshots in this directory, restart from them if present.')
+    parser.add_argument('--group-commit',
+			dest='group_commits', type=int, default=1,
+			help='Number of commits written to the log per fsync.')
+    parser.add_argument('--group-ticks',
+			dest='group_ticks', type=int, default=0,
+			help='Most commands a logged commit waits for its fsync, 0 for no limit.')
+    parser.add_argument('--checkpoint',
+			dest='checkpoint_ticks', type=int, default=0,
+			help='Commands between snapshots, 0 for no snapshot.')
+    parser.add_argument('--workers',
+			dest='workers', type=int, default=0,
+			help='Run the sites in this many worker processes, 0 to run them in this process.')
+    parser.add_argument('--max-hot',
+			dest='max_hot', type=int, default=0,
+			help='Queue the begins of read-write transactions while this many touch hot variables(see tm.scheduler), 0 to admit all.')
+    parser.add_argument('--state',
+			dest='state_file',
+			help='Write the committed values of all copies at the end: .csv, .npy(values only) or .npz(needs numpy).')
+    parser.add_argument('--metrics',
+			dest='metrics_file',
+			help='Collect metrics and write them to a json file.')
+    parser.add_argument('--output',
+			dest='output', default='text', choices=sorted(SINKS),
+			help='Output format: text, json lines, or null to drop all output.')
+    parser.add_argument('--check',
+			dest='check', action='store_true',
+			help='Check that the history is serializable and follows available copies(see tm.checker), violations go to stderr.')
+    return parser
+
+def tm_options(args):
+    """
+    get the TransactionManager arguments given on the command line
+    input: parsed arguments
+    output: dict of keyword arguments, without the output, metrics and commit log
+    side effect: None
+    """
+    return {"num_sites": args.num_sites, "num_vars": args.num_vars, "replication": args.replication,
+            "deadlock": args.deadlock, "replica_selection": args.replica_selection,
+            "workers": args.workers, "protocol": args.protocol,
+            "read_quorum": args.read_quorum, "write_quorum": args.write_quorum,
+            "catch_up": args.catch_up, "isolation": args.isolation, "history": args.history}
+
+def main():
+    args = make_parser().parse_args()
+    output = SINKS[args.output]()
+    if args.trace_file is not None:
+        commandIter = traceReader(args.trace_file)
+    elif args.test_file is None:
+        #the echo would break json lines, the text output is not buffered(see below)
+        commandIter = streamReader(sys.stdin, args.output == 'text')
+        if args.output != 'null':
+            #answer every command right away
+            output.buffer_size = 1
     else:
         commandIter = fileReader(args.test_file)
-    tm.loadCommand(commandIter)
+    if args.record_file is not None:
+        commandIter = recorder(commandIter, args.record_file)
+    checker = None
+    if args.check:
+        checker = Checker(output)
+        output = checker
+    wal = None
+    if args.wal_dir is not None:
+        wal = CommitLog(args.wal_dir, args.group_commits, args.group_ticks, args.checkpoint_ticks)
+    tm = TransactionManager(metrics=args.metrics_file is not None, output=output, wal=wal,
+                            **tm_options(args))
+    if wal is not None:
+        _ = wal.restore(tm)
+    if args.max_hot > 0:
+        commandIter = Scheduler(tm, commandIter, args.max_hot)
+    try:
+        tm.loadCommand(commandIter)
+        if args.state_file is not None:
+            tm.state().save(args.state_file)
+    finally:
+        output.flush()
+        tm.close()
+    if args.metrics_file is not None:
+        with open(args.metrics_file, "w") as f:
+            json.dump(tm.metrics.snapshot(), f, indent=2)
+    if checker is not None:
+        result = checker.summary()
+        for message in result["messages"]:
+            print(message, file=sys.stderr)
+        if result["violations"] > 0:
+            sys.exit("{} violations in {} commits".format(result["violations"], result["commits"]))
 
 
 if __name__=='__main__':
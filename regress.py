@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import concurrent.futures
+import difflib
+import fnmatch
+import io
+import json
+import os
+import shlex
+import sys
+import tempfile
+import traceback
+from tm.TransManager import TransactionManager
+from tm.output import TextSink
+from tm.checker import Checker
+from tm.scheduler import Scheduler
+from tm.server import Server
+from tm.wal import CommitLog
+from trans.trace import recorder, traceReader
+from main import commandParser, fileReader, make_parser, tm_options
+
+OPTIONS = "// options:" #header line of a scenario run with main.py options, e.g. // options: --deadlock wound-wait
+FILE_OPTIONS = ("wal_dir", "record_file", "state_file", "metrics_file") #options of main.py that write files
+
+
+def expected_name(test_name):
+    """
+    name of the expected output of a scenario: test12 -> res12
+    input: scenario file name
+    output: expected output file name
+    side effect: None
+    """
+    if test_name.startswith("test"):
+        return "res" + test_name[len("test"):]
+    return test_name
+
+def scenario_options(test_path):
+    """
+    get the main.py options of a scenario, from its "// options:" lines before the first command
+    input: scenario path
+    output: parsed arguments, the defaults without options
+    side effect: None
+    """
+    options = []
+    with open(test_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(OPTIONS):
+                options.extend(shlex.split(line[len(OPTIONS):]))
+            elif len(line) > 0 and not line.startswith("//"):
+                break
+    return make_parser().parse_args(options)
+
+def run_scenario(test_path):
+    """
+    run a scenario with a fresh TransactionManager built from its options, the files of the
+    --wal, --record, --state and --metrics options are written to a temporary directory and
+    checked after the run(see check_files)
+    input: scenario path
+    output: output text, like main.py -f with stderr
+    side effect: None
+    """
+    stream = io.StringIO()
+    output = TextSink(stream)
+    tm = None
+    try:
+        args = scenario_options(test_path)
+        with tempfile.TemporaryDirectory() as files:
+            checker = Checker(output) if args.check else None
+            wal = None
+            if args.wal_dir is not None:
+                wal = CommitLog(os.path.join(files, "wal"), args.group_commits, args.group_ticks,
+                                args.checkpoint_ticks)
+            tm = TransactionManager(output=output if checker is None else checker, wal=wal,
+                                    metrics=args.metrics_file is not None, **tm_options(args))
+            commands = fileReader(test_path)
+            if args.record_file is not None:
+                commands = recorder(commands, os.path.join(files, "trace"))
+            if args.max_hot > 0:
+                commands = Scheduler(tm, commands, args.max_hot)
+            tm.loadCommand(commands)
+            output.flush()
+            if checker is not None:
+                #violations are part of the expected output
+                for message in checker.summary()["messages"]:
+                    stream.write(message + "\n")
+            check_files(args, tm, files, stream)
+    except (Exception, SystemExit):
+        output.flush()
+        stream.write(traceback.format_exc())
+    finally:
+        if tm is not None:
+            tm.close()
+    return stream.getvalue()
+
+def check_files(args, tm, files, stream):
+    """
+    write what the files of a scenario hold after its run, each part after a "// " line:
+    the dump of a TransactionManager restarted from the commit log, the output of a replay of
+    the trace, the state table(.csv) and the metrics
+    input: parsed options, TransactionManager of the run, directory of the files, output stream
+    output: None
+    side effect: None
+    """
+    if args.wal_dir is not None:
+        wal = CommitLog(os.path.join(files, "wal"))
+        restarted = TransactionManager(output=TextSink(stream), wal=wal, **tm_options(args))
+        try:
+            stream.write("// restart: {} log records replayed\n".format(wal.restore(restarted)))
+            restarted.loadCommand(commandParser("dump()"))
+        finally:
+            restarted.close()
+    if args.record_file is not None:
+        stream.write("// replay\n")
+        replayed = TransactionManager(output=TextSink(stream), **tm_options(args))
+        try:
+            replayed.loadCommand(traceReader(os.path.join(files, "trace")))
+        finally:
+            replayed.close()
+    if args.state_file is not None:
+        path = os.path.join(files, "state.csv")
+        tm.state().save(path)
+        stream.write("// state\n")
+        with open(path, "r") as f:
+            stream.write(f.read())
+    if args.metrics_file is not None:
+        stream.write("// metrics\n")
+        stream.write(json.dumps(tm.metrics.snapshot(), indent=2) + "\n")
+
+async def send_scenario(server, test_path):
+    """
+    connect to a server over a loopback listener and send the lines of a scenario
+    input: Server, scenario path
+    output: output text received until the server closes the connection
+    side effect: the listener and the command loop are stopped
+    """
+    listener = await server.serve("127.0.0.1", 0)
+    reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+
+    async def send():
+        with open(test_path, "rb") as f:
+            for line in f:
+                writer.write(line)
+                await writer.drain()
+        writer.write_eof()
+
+    try:
+        _, output = await asyncio.gather(send(), reader.read())
+        return output.decode()
+    finally:
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        server.runner.cancel()
+
+def run_loopback(test_path):
+    """
+    run a scenario as one client of a tm.server.Server, the expected output is the same as
+    in-process except that a bad command is reported and skipped instead of ending the run
+    input: scenario path
+    output: output text
+    side effect: None
+    """
+    args = scenario_options(test_path)
+    if args.max_hot > 0 or args.check or any(getattr(args, name) is not None for name in FILE_OPTIONS):
+        #the server has no admission control nor checker, and writes no files
+        return run_scenario(test_path)
+    tm = TransactionManager(**tm_options(args))
+    try:
+        return asyncio.run(send_scenario(Server(tm), test_path))
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        tm.close()
+
+def check_scenario(test_path, res_path, loopback=False):
+    """
+    run a scenario and compare it with its expected output
+    input: scenario path, expected output path, True to run it through a loopback server
+    output: (scenario name, True if passed, unified diff)
+    side effect: None
+    """
+    name = os.path.basename(test_path)
+    actual = run_loopback(test_path) if loopback else run_scenario(test_path)
+    if not os.path.exists(res_path):
+        return (name, False, "missing {}\n".format(res_path))
+    with open(res_path, "r") as f:
+        expected = f.read()
+    if actual == expected:
+        return (name, True, "")
+    diff = difflib.unified_diff(expected.splitlines(True), actual.splitlines(True),
+                                res_path, name)
+    return (name, False, "".join(diff))
+
+def sort_key(name):
+    """
+    natural order: test2 before test10
+    input: name
+    output: key
+    side effect: None
+    """
+    digits = "".join(c for c in name if c.isdigit())
+    return (name.rstrip("0123456789"), int(digits) if digits else -1, name)
+
+def main():
+    description = "Run the test scenarios in-process and compare them with the expected outputs"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('pattern', nargs='?', default='*',
+			help='Only run the scenarios whose name matches this glob.')
+    parser.add_argument('--tests', default='test',
+			help='Directory of the scenarios.')
+    parser.add_argument('--expected', default='res',
+			help='Directory of the expected outputs, scenario testN is compared with resN.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+			help='Number of worker processes.')
+    parser.add_argument('-q', '--quiet', action='store_true',
+			help='Only print the failures and the summary.')
+    parser.add_argument('--loopback', action='store_true',
+			help='Send each scenario to a tm.server listening on a loopback port instead.')
+    args = parser.parse_args()
+    names = sorted((name for name in os.listdir(args.tests)
+                    if fnmatch.fnmatch(name, args.pattern)
+                    and os.path.isfile(os.path.join(args.tests, name))), key=sort_key)
+    jobs = [(os.path.join(args.tests, name), os.path.join(args.expected, expected_name(name)))
+            for name in names]
+    results = []
+    if len(jobs) > 0:
+        tests, expected = zip(*jobs)
+        #a few chunks per worker, thousands of small scenarios do not pay one round trip each
+        chunksize = max(1, len(jobs) // (4*args.jobs))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(check_scenario, tests, expected, [args.loopback]*len(jobs),
+                                    chunksize=chunksize))
+    failed = []
+    for name, passed, diff in results:
+        if passed:
+            if not args.quiet:
+                print("{} pass".format(name))
+        else:
+            failed.append(name)
+            print("{} FAIL".format(name))
+            sys.stdout.write(diff)
+    print("{} passed, {} failed".format(len(results) - len(failed), len(failed)))
+    if len(failed) > 0:
+        print("failed: {}".format(" ".join(failed)))
+        sys.exit(1)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,377 @@
+import collections
+class LockEntry:
+    """
+    LockEntry class, the lock on one variable for all its copies
+    """
+    __slots__ = ("mode", "holders")
+
+    def __init__(self, mode):
+        """
+        create a lock without holders
+        input: lock mode("R"/"W")
+        output: None
+        side effect: None
+        """
+        self.mode = mode        #R, W
+        self.holders = dict()   #up sites where each holder has the lock {<str:trans id>:set(<int:site id>)}
+
+    def at_sites(self, site_ids):
+        """
+        check whether some holder has the lock at one of some sites
+        input: site ids
+        output: True/False
+        side effect: None
+        """
+        for sites in self.holders.values():
+            if not sites.isdisjoint(site_ids):
+                return True
+        return False
+
+
+class LockTable:
+    """
+    LockTable class, the locks of all sites, one logical lock per variable
+    instead of one lock in each site holding a copy
+    """
+    def __init__(self, metrics, deadlock="detect"):
+        """
+        create an empty lock table
+        input: metrics(see tm.metrics), deadlock policy("detect", "wait-die" or "wound-wait")
+        output: None
+        side effect: None
+        """
+        self.metrics = metrics
+        self.deadlock = deadlock
+        self.trans = dict() #transactions holding a lock {<str:trans id>:Transaction}
+        self.victims = [] #trans ids aborted by wait-die or wound-wait, ended by the TransactionManager
+        self.locktable = dict() #format {<int:variable>:LockEntry}
+        self.trans_locks = dict() #variables locked by each transaction, may contain ones lost at failed sites
+                                  #format {<str:trans id>:set(<int:variable>)}
+        self.site_locks = dict() #variables locked at each site, may contain released ones
+                                #format {<int:site id>:set(<int:variable>)}
+        self.held = collections.Counter() #number of lock copies held at each site {<int:site id>:count}
+        self.waits = collections.Counter() #lock requests that had to wait on each variable {<int:variable>:count}
+
+    def check_lock(self, trans, wait_list, site_ids=None):
+        """
+        check whether the transaction can get the lock
+        input: transaction, wait_list, site ids to check a read at some copies only
+        output: True/False
+        side effect: None
+        """
+        entry = self.locktable.get(trans.op.var)
+        if entry is not None and site_ids is not None and not entry.at_sites(site_ids):
+            entry = None
+        return check_lock(entry, trans, wait_list)
+
+    def lock(self, trans, wait_list, wait_graph, sites):
+        """
+        access the lock at some up sites or add to wait_list and wait_graph
+        input: transaction, wait_list, wait_graph, site ids(the copies read, or the copies written)
+        output: True/False
+        side effect: if the lock cannot be accessed, add transaction to wait_list and
+            add its wait-for edges to wait_graph, otherwise access the lock
+        """
+        var = trans.op.var
+        if self.check_lock(trans, wait_list, sites if trans.op.op_type == "R" else None):
+            self.grant(trans, var, trans.op.op_type, sites)
+            if trans.waiting is not None:
+                #woken, it waits for no one anymore
+                wait_graph.set_edges(trans.transid, ())
+            dequeue(wait_list, trans)
+            self.metrics.lock_granted(trans, var)
+            return True
+        self.waits[var] += 1
+        self.metrics.lock_blocked(trans, var)
+        entry = self.locktable.get(var)
+        if self.deadlock == "detect":
+            block(entry, trans, wait_list, wait_graph)
+        elif self.prevent(entry, trans, wait_list):
+            #no cycle can form, the wait-for graph is not needed
+            enqueue(wait_list, trans)
+        return False
+
+    def prevent(self, entry, trans, wait_list):
+        """
+        apply wait-die or wound-wait to a transaction that would wait, the begin time of a
+        transaction is its priority(older is higher); with wait-die it dies if it would wait for
+        an older one, with wound-wait it wounds the younger ones it would wait for
+        input: lock entry of the variable of its operation, transaction, wait_list
+        output: True if it waits, False if it dies
+        side effect: the victims are marked to abort and added to victims
+        """
+        queued = {item.transid: item for item in wait_list.get(trans.op.var, ())}
+        others = [queued[i] if i in queued else self.trans[i] for i in wait_edges(entry, trans, wait_list)]
+        if self.deadlock == "wait-die":
+            if any(other.time < trans.time for other in others):
+                self.abort(trans)
+                return False
+            return True
+        for other in others:
+            if other.time > trans.time:
+                self.abort(other)
+        return True
+
+    def abort(self, trans):
+        """
+        make a transaction a victim of wait-die or wound-wait
+        input: transaction
+        output: None
+        side effect: it is marked to abort, and ended with the command(see TransactionManager.check_deadlock)
+        """
+        if trans.transid not in self.victims:
+            trans.set_abort("deadlock")
+            self.victims.append(trans.transid)
+
+    def rewait(self, trans, wait_list, wait_graph):
+        """
+        rebuild what a queued transaction waits for, after one it waited for ended
+        and it is not at the head of its queue
+        input: transaction, wait_list, wait_graph
+        output: None
+        side effect: its edges in wait_graph are replaced
+        """
+        wait_graph.set_edges(trans.transid, wait_edges(self.locktable.get(trans.op.var), trans, wait_list))
+
+    def grant(self, trans, var, mode, sites):
+        """
+        give the lock on a variable at some sites to a transaction
+        input: transaction, variable, lock mode("R"/"W"), site ids
+        output: None
+        side effect: locktable, trans_locks and site_locks updated, the sites are added
+            to the sites touched by trans
+        """
+        if len(sites) == 0:
+            return
+        if var not in self.locktable:
+            self.locktable[var] = LockEntry(mode)
+        entry = self.locktable[var]
+        if mode == "W":
+            entry.mode = "W"
+        if trans.transid not in entry.holders:
+            entry.holders[trans.transid] = set()
+        holder_sites = entry.holders[trans.transid]
+        for i in sites:
+            if i not in holder_sites:
+                holder_sites.add(i)
+                self.held[i] += 1
+        if trans.transid not in self.trans_locks:
+            self.trans_locks[trans.transid] = set()
+            self.trans[trans.transid] = trans
+        self.trans_locks[trans.transid].add(var)
+        for i in sites:
+            if i not in self.site_locks:
+                self.site_locks[i] = set()
+            self.site_locks[i].add(var)
+        trans.sites.update(sites)
+
+    def unlock(self, transid):
+        """
+        release all the locks of a transaction
+        input: trans id
+        output: None
+        side effect: entries without holders are removed
+        """
+        _ = self.trans.pop(transid, None)
+        for var in self.trans_locks.pop(transid, ()):
+            entry = self.locktable.get(var)
+            if entry is None:
+                #lost at a failed site
+                continue
+            for i in entry.holders.pop(transid, ()):
+                self.held[i] -= 1
+            if len(entry.holders) == 0:
+                del self.locktable[var]
+
+    def failed(self, site_id):
+        """
+        drop the copies of the locks held at a failed site
+        input: site id
+        output: list of trans ids that held a lock at the site
+        side effect: holders without any up site left lose the lock
+        """
+        trans_to_abort = set()
+        for var in self.site_locks.pop(site_id, ()):
+            entry = self.locktable.get(var)
+            if entry is None:
+                continue
+            for transid in list(entry.holders):
+                sites = entry.holders[transid]
+                if site_id not in sites:
+                    continue
+                trans_to_abort.add(transid)
+                sites.discard(site_id)
+                self.held[site_id] -= 1
+                if len(sites) == 0:
+                    #it stays in trans_locks, its end wakes the waiters of the variable
+                    del entry.holders[transid]
+            if len(entry.holders) == 0:
+                del self.locktable[var]
+        return sorted(trans_to_abort)
+
+
+class WaitQueue:
+    """
+    WaitQueue class, transactions waiting for the lock on one variable in FIFO order
+    """
+    __slots__ = ("var", "queue", "members")
+
+    def __init__(self, var):
+        """
+        create an empty queue
+        input: variable
+        output: None
+        side effect: None
+        """
+        self.var = var
+        self.queue = collections.deque() #waiting transactions, head first
+        self.members = set()             #same transactions, for membership tests
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __contains__(self, trans):
+        return trans in self.members
+
+    def __getitem__(self, idx):
+        return self.queue[idx]
+
+    def append(self, trans):
+        """
+        add a transaction at the tail
+        input: transaction
+        output: None
+        side effect: trans.waiting is set to the variable of the queue
+        """
+        self.queue.append(trans)
+        self.members.add(trans)
+        trans.waiting = self.var
+
+    def remove(self, trans):
+        """
+        remove a transaction, usually the head
+        input: transaction
+        output: None
+        side effect: trans.waiting is cleared
+        """
+        if self.queue[0] is trans:
+            self.queue.popleft()
+        else:
+            self.queue.remove(trans)
+        self.members.discard(trans)
+        trans.waiting = None
+
+
+def check_lock(entry, trans, wait_list):
+    """
+    check whether the transaction can get the lock
+    input: lock entry of the variable of its operation(None if not locked), transaction, wait_list
+    output: True/False
+    side effect: None
+    """
+    var = trans.op.var
+    if entry is None:
+        #the variable is not locked
+        if var in wait_list and trans not in wait_list[var]:
+            return False
+        return True
+    if entry.mode == "R":
+        #has a read lock
+        if trans.op.op_type == "R":
+            #new op is read, it shares the lock unless others wait before it
+            if var in wait_list and wait_list[var][0] is not trans and trans.transid not in entry.holders:
+                return False
+            return True
+        else: # new op is write
+            if len(entry.holders)==1 and trans.transid in entry.holders:
+                if var not in wait_list or wait_list[var][0] is trans:
+                    return True
+            return False
+    else: # has a write lock
+        if trans.transid in entry.holders:
+            #already has a write lock
+            return True
+        return False
+
+def wait_edges(entry, trans, wait_list):
+    """
+    get the transactions a queued transaction waits for: the holders of a conflicting lock
+    and the conflicting transactions queued before it
+    input: lock entry of the variable of its operation(None if not locked), transaction, wait_list
+    output: set of trans ids
+    side effect: None
+    """
+    write = trans.op.op_type == "W"
+    edges = set()
+    if entry is not None and (write or entry.mode == "W"):
+        edges.update(entry.holders)
+        edges.discard(trans.transid)
+    for item in wait_list.get(trans.op.var, ()):
+        if item is trans:
+            break
+        if write or item.op.op_type == "W":
+            edges.add(item.transid)
+    return edges
+
+def block(entry, trans, wait_list, wait_graph):
+    """
+    make a transaction wait for the lock of the variable of its operation
+    input: lock entry of the variable, transaction, wait_list, wait_graph
+    output: None
+    side effect: trans is added to wait_list and its wait-for edges to wait_graph
+    """
+    var = trans.op.var
+    wait_graph.add_node(trans.transid)
+    if trans.waiting == var:
+        #woken at the head of its queue and blocked again, it keeps its place
+        wait_graph.set_edges(trans.transid, wait_edges(entry, trans, wait_list))
+        return
+    if var not in wait_list:
+        for i in entry.holders:
+            if i != trans.transid:
+                wait_graph.add_edge(trans.transid, i)
+    else:
+        sublist = wait_list[var]
+        idx = len(sublist)-1
+        item = sublist[idx]
+        if item.op.op_type == "W":
+            if item != trans:
+                wait_graph.add_edge(trans.transid, item.transid)
+        else:
+            if trans.op.op_type == "R":
+                wait_graph.set_edges(trans.transid, wait_graph.edges(item.transid))
+            else:
+                while(idx >= 0 and sublist[idx].op.op_type=="R"):
+                    if trans != sublist[idx]:
+                        wait_graph.add_edge(trans.transid, item.transid)
+                    idx-=1
+    enqueue(wait_list, trans)
+
+def enqueue(wait_list, trans):
+    """
+    put a transaction in the wait queue of the variable of its operation
+    input: wait_list, transaction
+    output: None
+    side effect: trans leaves the queue it was waiting in before, if any
+    """
+    var = trans.op.var
+    if trans.waiting == var:
+        return
+    dequeue(wait_list, trans)
+    if var not in wait_list:
+        wait_list[var] = WaitQueue(var)
+    wait_list[var].append(trans)
+
+def dequeue(wait_list, trans):
+    """
+    take a transaction out of the wait queue it is waiting in
+    input: wait_list, transaction
+    output: None
+    side effect: empty queues are removed from wait_list
+    """
+    var = trans.waiting
+    if var is None:
+        return
+    wait_list[var].remove(trans)
+    if len(wait_list[var]) == 0:
+        del wait_list[var]
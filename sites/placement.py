@@ -0,0 +1,94 @@
+import array
+
+
+def default_rule(var, sites):
+    """
+    even index variables in all sites, odd index variables in site (1+index mod number of sites)
+    input: variable, tuple of all site ids
+    output: tuple of site ids holding the variable
+    side effect: None
+    """
+    if var % 2 == 0:
+        return sites
+    return (sites[var % len(sites)],)
+
+def all_rule(var, sites):
+    """
+    every variable in all sites
+    input: variable, tuple of all site ids
+    output: tuple of site ids holding the variable
+    side effect: None
+    """
+    return sites
+
+def single_rule(var, sites):
+    """
+    every variable in site (1+index mod number of sites) only
+    input: variable, tuple of all site ids
+    output: tuple of site ids holding the variable
+    side effect: None
+    """
+    return (sites[var % len(sites)],)
+
+RULES = {"default": default_rule, "all": all_rule, "single": single_rule}
+
+
+class Placement:
+    """
+    Placement class, which variables are stored in which sites
+    """
+    def __init__(self, num_sites=10, num_vars=20, rule="default"):
+        """
+        precompute the sites of every variable and the variables of every site
+        input: number of sites, number of variables, replication rule(name in RULES or function)
+        output: None
+        side effect: None
+        """
+        if rule in RULES:
+            rule = RULES[rule]
+        self.num_sites = num_sites
+        self.num_vars = num_vars
+        sites = tuple(range(1, num_sites+1))
+        self.var_sites = [()] #var_sites[var] is the tuple of site ids holding var
+        self.site_vars = [array.array("l") for i in range(num_sites+1)] #site_vars[site] is the sorted array of variables in site
+        for var in range(1, num_vars+1):
+            holders = rule(var, sites)
+            self.var_sites.append(holders)
+            for i in holders:
+                self.site_vars[i].append(var)
+
+    def sites_of(self, var):
+        """
+        get the sites holding a variable
+        input: variable
+        output: tuple of site ids
+        side effect: None
+        """
+        return self.var_sites[var]
+
+    def vars_of(self, site_id):
+        """
+        get the variables stored in a site
+        input: site id
+        output: sorted array of variables, shared, must not be modified
+        side effect: None
+        """
+        return self.site_vars[site_id]
+
+    def is_replicated(self, var):
+        """
+        check whether a variable has copies in more than one site
+        input: variable
+        output: True/False
+        side effect: None
+        """
+        return len(self.var_sites[var]) > 1
+
+    def initial(self, var):
+        """
+        get the initial value of a variable
+        input: variable
+        output: 10 times the variable index
+        side effect: None
+        """
+        return 10*var
@@ -0,0 +1,204 @@
+def low_bit(mask):
+    """
+    get the lowest site id in a site mask
+    input: site mask(bit i set for site i), not 0
+    output: site id
+    side effect: None
+    """
+    return (mask & -mask).bit_length() - 1
+
+def lowest_select(index, var, mask):
+    """
+    read from the readable copy with the lowest site id
+    input: ReplicaIndex, variable, mask of readable sites
+    output: site id
+    side effect: None
+    """
+    return low_bit(mask)
+
+def round_robin_select(index, var, mask):
+    """
+    read from the next readable copy after the one used by the previous read
+    input: ReplicaIndex, variable, mask of readable sites
+    output: site id
+    side effect: the turn of the index moves on
+    """
+    index.turn = index.turn % index.placement.num_sites + 1
+    high = mask >> index.turn
+    if high != 0:
+        return index.turn + low_bit(high)
+    return low_bit(mask)
+
+def least_locked_select(index, var, mask):
+    """
+    read from the readable copy at the site holding the fewest locks, lowest site id on ties
+    input: ReplicaIndex, variable, mask of readable sites
+    output: site id
+    side effect: None
+    """
+    best = -1
+    best_load = 0
+    while mask != 0:
+        site_id = low_bit(mask)
+        mask &= mask - 1
+        load = index.load(site_id)
+        if best == -1 or load < best_load:
+            best = site_id
+            best_load = load
+    return best
+
+SELECTIONS = {"lowest": lowest_select, "round-robin": round_robin_select,
+              "least-locked": least_locked_select}
+
+
+class ReplicaIndex:
+    """
+    ReplicaIndex class, the sites where each replicated variable can be read,
+    kept up to date on site failure and commit instead of scanning the sites on every read
+    """
+    def __init__(self, placement, selection="lowest", load=None):
+        """
+        every copy starts readable
+        input: placement, replica selection(name in SELECTIONS or function),
+            function giving the number of locks held at a site(for least-locked)
+        output: None
+        side effect: None
+        """
+        if selection in SELECTIONS:
+            selection = SELECTIONS[selection]
+        self.placement = placement
+        self.selection = selection
+        self.load = load
+        self.turn = 0
+        self.readable = self.all_readable() #readable[var] is the mask of up sites where var can be read, bit i for site i
+        self.waiters = dict() #transactions waiting for a readable copy, in arrival order
+                              #format {<int:variable>:{<str:trans id>:None}}
+        self.waiting = dict() #variable each of them waits for {<str:trans id>:<int:variable>}
+
+    def all_readable(self):
+        """
+        get the masks when every copy can be read
+        input: None
+        output: list of masks indexed by variable, 0 for variables that are not replicated
+        side effect: None
+        """
+        readable = [0]
+        masks = dict() #variables with the same sites tuple share one mask object {<int:id of tuple>:mask}
+        for var in range(1, self.placement.num_vars+1):
+            sites = self.placement.sites_of(var)
+            if len(sites) > 1:
+                if id(sites) not in masks:
+                    masks[id(sites)] = sum(1 << i for i in sites)
+                readable.append(masks[id(sites)])
+            else:
+                readable.append(0)
+        return readable
+
+    def reset(self, site_list):
+        """
+        rebuild the masks from the status and read_available of the sites,
+        only the copies that cannot be read are visited
+        input: site list
+        output: None
+        side effect: None
+        """
+        self.readable = self.all_readable()
+        for site in site_list[1:]:
+            if site.status != "ON":
+                self.failed(site.siteid)
+                continue
+            bit = ~(1 << site.siteid)
+            pos = site.read_available.find(0)
+            while pos != -1:
+                self.readable[site.var_ids[pos]] &= bit
+                pos = site.read_available.find(0, pos+1)
+
+    def select(self, var):
+        """
+        pick the copy a read goes to
+        input: replicated variable
+        output: site id, -1 if no copy can be read
+        side effect: None
+        """
+        mask = self.readable[var]
+        if mask == 0:
+            return -1
+        return self.selection(self, var, mask)
+
+    def wait(self, var, transid):
+        """
+        make a transaction wait until some copy of a variable can be read again
+        input: replicated variable, trans id
+        output: None
+        side effect: None
+        """
+        self.cancel(transid)
+        if var not in self.waiters:
+            self.waiters[var] = dict()
+        self.waiters[var][transid] = None
+        self.waiting[transid] = var
+
+    def is_waiting(self, transid):
+        """
+        check whether a transaction waits for a readable copy
+        input: trans id
+        output: True/False
+        side effect: None
+        """
+        return transid in self.waiting
+
+    def cancel(self, transid):
+        """
+        stop a transaction from waiting for a readable copy, because it ends or the
+        operation it waited with is replaced
+        input: trans id
+        output: None
+        side effect: None
+        """
+        var = self.waiting.pop(transid, None)
+        if var is None:
+            return
+        waiters = self.waiters[var]
+        del waiters[transid]
+        if len(waiters) == 0:
+            del self.waiters[var]
+
+    def failed(self, site_id):
+        """
+        no copy at a failed site can be read, replicated copies stay unreadable
+        after recovery until they are written
+        input: site id
+        output: None
+        side effect: None
+        """
+        bit = ~(1 << site_id)
+        for var in self.placement.vars_of(site_id):
+            self.readable[var] &= bit
+
+    def complete(self, site_id):
+        """
+        check whether every replicated copy at a site can be read
+        input: site id
+        output: True/False
+        side effect: None
+        """
+        bit = 1 << site_id
+        for var in self.placement.vars_of(site_id):
+            if self.readable[var] & bit == 0 and len(self.placement.sites_of(var)) > 1:
+                return False
+        return True
+
+    def written(self, var, site_id):
+        """
+        a committed write made a copy readable
+        input: replicated variable, site id
+        output: list of trans ids that were waiting for a readable copy
+        side effect: the waiters are forgotten
+        """
+        self.readable[var] |= 1 << site_id
+        waiters = self.waiters.pop(var, None)
+        if waiters is None:
+            return []
+        for transid in waiters:
+            del self.waiting[transid]
+        return list(waiters)
@@ -1,168 +1,120 @@
+import array
+import bisect
+import sys
+
+OWN_WRITE = sys.maxsize #version of a write not committed yet, newer than every commit
+
 class Site:
     """
     Site class
     Author: Yiming Li
     """
-    def __init__(self, ID):
+    def __init__(self, ID, placement, replicas):
         """
-        initialize variable values in the site, even index variables in all sites,
-        odd index variables in site (1+index mod 10)
+        initialize variable values in the site, the variables stored in the site
+        are given by the placement
         Author: Yiming Li
-        input: None
+        input: site id, placement, readable replica index(see sites.replica)
         output: None
-        side effect: the variables stored in the site are initialized and put into pre_version
+        side effect: the variables stored in the site are initialized
         """
         self.siteid = ID    #site 1, 2, 3, ...
         self.status = "ON" #ON, OFF
         self.version = 0    #commit version????
-        self.variable = [None]*20 #variable values
-        self.locktable = dict() #format {<int:variable>:['R/W',set(<str:trans id>)]}
+        self.placement = placement
+        self.replicas = replicas
+        self.var_ids = placement.vars_of(ID) #sorted array of the variables in the site
+        self.values = array.array("q", map(placement.initial, self.var_ids)) #values[slot] is the value of var_ids[slot]
         self.buffer = dict() #store the values changed for each transaction before commit
                             #format{<str:trans id>:{<int:variable>:<int:value>...}}
-        self.pre_version = dict() #store variable values from previous versions
-                                #format {<int:commit_timestamp>:variable list}
-        self.read_available = [True]*10
-        self.recovered_map = {} #store variable values with list of transaction
-        for i in range(2,21,2):
-            self.variable[i-1] = 10*i
-        if self.siteid % 2 == 0:
-            self.variable[self.siteid - 2] = (self.siteid - 1) * 10
-            self.variable[self.siteid - 2 + 10] = (self.siteid + 10 - 1) * 10
-        self.pre_version[0] = [self.variable[i] for i in range(len(self.variable))]
+        self.versions = dict() #committed versions of each variable written since start, oldest first
+                            #format {<int:variable>:([<int:commit_timestamp>...], [<int:value>...])}
+        self.read_available = bytearray(b"\x01") * len(self.var_ids) #read_available[slot] is 1 if var_ids[slot] can be read
+        #after a recovery only the non-replicated variables can be read
+        self.recover_mask = bytes(0 if placement.is_replicated(var) else 1 for var in self.var_ids)
 
     def get_variable(self):
         """
         get all variables stored in the site
         Author: Yiming Li
         input: None
-        output: site variables
+        output: site variables {<int:variable>:<int:value>}
+        side effect: None
+        """
+        return dict(self.items())
+
+    def slot(self, var):
+        """
+        find where a variable is stored in the site arrays
+        input: variable
+        output: slot index, -1 if the variable is not in the site
+        side effect: None
+        """
+        idx = bisect.bisect_left(self.var_ids, var)
+        if idx < len(self.var_ids) and self.var_ids[idx] == var:
+            return idx
+        return -1
+
+    def get(self, var):
+        """
+        get the committed value of a variable
+        input: variable
+        output: value
         side effect: None
         """
-        return self.variable
+        return self.values[self.slot(var)]
+
+    def items(self):
+        """
+        get all committed values
+        input: None
+        output: iterator of (variable, value) in variable order
+        side effect: None
+        """
+        return zip(self.var_ids, self.values)
+
+    def columns(self):
+        """
+        get the committed state of the site as arrays, for bulk copies
+        input: None
+        output: (variables, values, read_available) in variable order, not copies
+        side effect: None
+        """
+        return (self.var_ids, self.values, self.read_available)
 
     """
-    read & write
+    read & write, the locks of all sites are kept by the TransactionManager(see sites.lock.LockTable)
     """
-    def check_lock(self, trans, wait_list):
+    def write(self, trans_id, var, value):
         """
-        check whether the transaction can get the lock
-        input: transaction, variable, wait_list
-        output: True/False
+        buffer a write until the transaction ends
+        input: trans_id, variable, value
+        output: None
         side effect: None
         """
-        var = trans.op.var
-        if var not in self.locktable:
-            #the variable is not locked
-            # print(wait_list)
-            if var in wait_list and len(wait_list[var]) != 0 and trans not in wait_list[var]:
-                return False
-            return True
-        else:
-            #variable has a lock
-            if self.locktable[var][0] == "R":
-                #has a read lock
-                if trans.op.op_type == "R":
-                    #new op is read
-                    if var in wait_list and len(wait_list[var]) != 0:
-                        return False
-                    return True
-                else: # new op is write
-                    if len(self.locktable[var][1])==1 and trans.transid in self.locktable[var][1]:
-                        if var not in wait_list or len(wait_list[var]) == 0 or (wait_list[var][0]==trans):
-                            return True
-                    return False
-            else: # has a write lock
-                if trans in self.locktable[var][1] and trans.op.op_type == "W":
-                    #already has a write lock
-                    return True
-                return False
-
-    def lock(self, trans, wait_list, block_list):
-        """
-        access a lock or add to wait_list and block_list
-        input: operation, transaction, variable, wait_list, block_list
-        output: True/False
-        side effect: if lock cannot be accessed, add transaction to wait_list and block_list
-            otherwise access the lock
-        """
-        var = trans.op.var
-        if self.check_lock(trans, wait_list):
-            #add lock to locktable
-            if var not in self.locktable:
-                self.locktable[var] = [trans.op.op_type,set([trans.transid])]
-            else:
-                if trans.transid not in self.locktable[var][1]:
-                    self.locktable[var][1].add(trans.transid)
-            if var in wait_list:
-                if trans in wait_list[var]:
-                    wait_list[var].pop(0)
-            return True
-        else:
-            if var not in wait_list:
-                wait_list[var] = []
-            if trans.transid not in block_list:
-                block_list[trans.transid] = set()
-            if len(wait_list[var]) == 0:
-                for i in self.locktable[var][1]:
-                    if i != trans.transid:
-                        block_list[trans.transid].add(i)
-            else:
-                sublist = wait_list[var]
-                idx = len(sublist)-1
-                item = sublist[idx]
-                if item.op.op_type == "W":
-                    if item != trans:
-                        block_list[trans.transid].add(item.transid)
-                else:
-                    if trans.op.op_type == "R":
-                        block_list[trans.transid] = [ele for ele in block_list[item.transid]]
-                    else:
-                        while(idx >= 0 and sublist[idx].op.op_type=="R"):
-                            if trans != sublist[idx]:
-                                block_list[trans.transid].add(item.transid)
-                            idx-=1
-            if trans not in wait_list[var]:
-                wait_list[var].append(trans)
-                
-            return False
-
-    def dump(self):
+        if trans_id not in self.buffer:
+            self.buffer[trans_id] = {}
+        self.buffer[trans_id][var] = value
+
+    def dump(self, output):
         """
         output the value of all variables in a site
         Author: Yiming Li
-        input: None
-        output: value of all 20 variables
+        input: output sink
+        output: value of all variables in the site
         side effect: None
         """
-        print("site {} -".format(self.siteid), end = " ")
-        for i in range(20):
-            if self.variable[i] is None:
-                continue
-            if i != 19:
-                print("x{}: {},".format(i+1, self.variable[i]), end = " ")
-            else:
-                print("x{}: {}".format(i+1, self.variable[i]))
+        output.dump_site(self.siteid, self.items())
 
     def failed(self):
         """
-        fail a site and clear the lock table
+        fail a site, its locks are dropped by the TransactionManager
         Author: Yiming Li
         input: None
-        output: return a list of transactions needed to abort when they commit
-        side effect: site status changes to OFF, and lock table is cleared
+        output: None
+        side effect: site status changes to OFF
         """
         self.status = "OFF"
-        trans_to_abort = []
-        for k,v in self.locktable.items():
-            for tran in v[1]:
-                if tran not in trans_to_abort:
-                    trans_to_abort.append(tran)
-        #search for the lock table
-        #find out which variable is locked by which transaction
-        #and mark this trans to abort when commit
-        #then clear the lock table.
-        self.locktable.clear()
-        return trans_to_abort
 
     def recovered(self):
         """
@@ -170,60 +122,126 @@ class Site:
         Author: Yiming Li
         input: None
         output: None
-        side effect: site status changes to ON
+        side effect: site status changes to ON, replicated variables cannot be read
+            until they are written
         """
         self.status = "ON"
+        self.read_available[:] = self.recover_mask
 
 
 
-    def unlock(self, transaction):
+    def finish(self, trans_id, commit, time, watermark):
         """
-        unlock all the lock made by the target transaction
+        commit or drop the buffered writes of an ending transaction
         Author: Xinsen Lu
-        input: transaction
+        input: trans_id, True to commit, end time,
+            watermark(begin time of the oldest running read-only transaction)
         output: return_list
         side effect: None
         """
-        #clean lock
-        id = transaction.transid
-        keys = []
         return_list = None
-        for key, value in self.locktable.items():
-            if id in value[1]:
-                value[1].remove(id)
-                if len(value[1])==0:
-                    keys.append(key)
-        for key in keys:
-            _ =  self.locktable.pop(key, None)
         #clean buffer
-        if transaction.ifabort == False:
-            return_list = self.commit_trans(id, transaction.endtime)
-        _ = self.buffer.pop(id, None)
+        if commit:
+            return_list = self.commit_trans(trans_id, time, watermark)
+        _ = self.buffer.pop(trans_id, None)
         return return_list
 
-    def commit_trans(self, trans_id, time):
+    def commit_trans(self, trans_id, time, watermark):
         """
         commit all the update made by the target transaction
         Author: Xinsen Lu
-        input: trans_id
+        input: trans_id, commit time, watermark(no reader needs a version older than it)
         output: return_list
-        side effect: None
+        side effect: new versions are added, versions older than the watermark are dropped
         """
 
         return_list = set()
         #variable update
         if trans_id in self.buffer:
             for key, value in self.buffer[trans_id].items():
-                # minus one because variable ranges from 0 to 19 in self.variable
-                self.variable[key-1] = value
-                if key%2==0:
-                    self.read_available[(key-1)//2]=True
-                    if key in self.recovered_map:
-                        return_list.update(self.recovered_map[key])
-
-        #pre-version update
-        self.pre_version[time] = []
-        for i in range(len(self.variable)):
-            self.pre_version[time].append(self.variable[i])
-    
-        return return_list
\ No newline at end of file
+                return_list.update(self.apply(key, time, value, watermark))
+
+        return return_list
+
+    def apply(self, var, time, value, watermark):
+        """
+        install a committed value of a variable
+        input: variable, commit time, value, watermark
+        output: trans ids that were waiting for a readable copy of the variable
+        side effect: a new version is added, a replicated copy can be read again
+        """
+        idx = self.slot(var)
+        self.values[idx] = value
+        self.add_version(var, time, value, watermark)
+        if self.recover_mask[idx] == 0:
+            self.read_available[idx] = 1
+            return self.replicas.written(var, self.siteid)
+        return ()
+
+    def version_chain(self, var):
+        """
+        get the committed versions of a variable, to copy them to a recovered copy
+        input: variable
+        output: ([<int:commit time>...], [<int:value>...]) oldest first, copies
+        side effect: None
+        """
+        if var not in self.versions:
+            return ([-1], [self.placement.initial(var)])
+        times, values = self.versions[var]
+        return (list(times), list(values))
+
+    def catch_up(self, var, times, values):
+        """
+        install the committed versions of a replicated variable copied from an up-to-date copy
+        input: variable, commit times, values(see version_chain)
+        output: trans ids that were waiting for a readable copy of the variable
+        side effect: the copy can be read again
+        """
+        idx = self.slot(var)
+        self.values[idx] = values[-1]
+        self.versions[var] = (times, values)
+        self.read_available[idx] = 1
+        return self.replicas.written(var, self.siteid)
+
+    def add_version(self, var, time, value, watermark):
+        """
+        append a committed version of a variable and garbage-collect its old versions
+        input: variable, commit time, value, watermark
+        output: None
+        side effect: versions that no reader at or after the watermark can see are removed
+        """
+        if var not in self.versions:
+            #initial values exist before the first command
+            self.versions[var] = ([-1], [self.placement.initial(var)])
+        times, values = self.versions[var]
+        times.append(time)
+        values.append(value)
+        #keep the newest version before the watermark, it is what the oldest reader sees
+        idx = bisect.bisect_left(times, watermark) - 1
+        if idx > 0:
+            del times[:idx]
+            del values[:idx]
+
+    def version_before(self, var, time):
+        """
+        get the last version of a variable committed before a given time
+        input: variable, time
+        output: (commit time, value), commit time -1 for the initial value
+        side effect: None
+        """
+        if var not in self.versions:
+            return (-1, self.placement.initial(var))
+        times, values = self.versions[var]
+        idx = bisect.bisect_left(times, time) - 1
+        return (times[idx], values[idx])
+
+    def read_latest(self, trans_id, var):
+        """
+        read a variable with the version of the value, for quorum reads
+        input: trans_id, variable
+        output: (commit time, value), commit time OWN_WRITE for an uncommitted write of trans_id
+        side effect: None
+        """
+        if trans_id in self.buffer and var in self.buffer[trans_id]:
+            return (OWN_WRITE, self.buffer[trans_id][var])
+        return self.version_before(var, OWN_WRITE)
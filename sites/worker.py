@@ -0,0 +1,504 @@
+import collections
+import multiprocessing
+from sites.placement import Placement
+from sites.site import Site, OWN_WRITE
+from tm.output import NullSink
+
+#messages to a worker are tuples (opcode, site id, args...), sent in batches(lists)
+WRITE, FINISH, GET, ITEMS, FAIL, RECOVER, VERSION_BEFORE, READ_LATEST, VERSION_CHAIN, CATCH_UP, \
+    COLUMNS = range(11)
+HELD = 256 #reads a DeferredSink holds back before it waits for the oldest one
+
+
+class WrittenVars:
+    """
+    stands in for the ReplicaIndex of the coordinator in a worker,
+    remembers which replicated copies became readable
+    """
+    def __init__(self):
+        """
+        input: None
+        output: None
+        side effect: None
+        """
+        self.vars = []
+
+    def written(self, var, site_id):
+        """
+        remember a copy made readable by a commit or a catch up
+        input: variable, site id
+        output: () as no transaction waits in the worker
+        side effect: None
+        """
+        self.vars.append(var)
+        return ()
+
+def serve(conn, site_ids, num_sites, num_vars, rule):
+    """
+    worker loop, runs the messages of each batch in order, then sends the results of
+    the messages that have one(FINISH of a commit asking for the copies it made readable, GET, ITEMS,
+    VERSION_BEFORE, READ_LATEST, VERSION_CHAIN, COLUMNS) as one list
+    input: pipe end, ids of the sites of the worker, number of sites, number of variables,
+        replication rule name
+    output: None
+    side effect: None
+    """
+    placement = Placement(num_sites, num_vars, rule)
+    written = WrittenVars()
+    sites = {i: Site(i, placement, written) for i in site_ids}
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            break
+        results = []
+        for msg in batch:
+            op = msg[0]
+            site = sites[msg[1]]
+            if op == WRITE:
+                site.write(msg[2], msg[3], msg[4])
+            elif op == FINISH:
+                written.vars = []
+                _ = site.finish(msg[2], msg[3], msg[4], msg[5])
+                if msg[6]:
+                    results.append(written.vars)
+            elif op == GET:
+                results.append(site.get(msg[2]))
+            elif op == ITEMS:
+                results.append(list(site.items()))
+            elif op == VERSION_BEFORE:
+                results.append(site.version_before(msg[2], msg[3]))
+            elif op == READ_LATEST:
+                results.append(site.read_latest(msg[2], msg[3]))
+            elif op == VERSION_CHAIN:
+                results.append(site.version_chain(msg[2]))
+            elif op == CATCH_UP:
+                _ = site.catch_up(msg[2], msg[3], msg[4])
+            elif op == COLUMNS:
+                results.append(site.columns())
+            elif op == FAIL:
+                site.failed()
+            else:
+                site.recovered()
+        if len(results) > 0:
+            conn.send(results)
+    conn.close()
+
+
+class Reply:
+    """
+    result of a message sent to a worker, received when it is needed
+    """
+    __slots__ = ("pool", "worker", "done", "value")
+
+    def __init__(self, pool, worker):
+        self.pool = pool
+        self.worker = worker
+        self.done = False
+        self.value = None
+
+    def result(self):
+        """
+        wait for the result
+        input: None
+        output: result of the message
+        side effect: every batch not sent yet is sent first
+        """
+        if not self.done:
+            self.pool.wait(self)
+        return self.value
+
+
+class WorkerPool:
+    """
+    WorkerPool class, the sites split in contiguous groups, one worker process per group
+    messages are queued per worker and only sent when some result is needed, so
+    the writes and commits fanned out to many sites run in all workers at the same time
+    """
+    def __init__(self, num_workers, placement, rule):
+        """
+        start the workers
+        input: number of workers, placement, replication rule name
+        output: None
+        side effect: worker processes started
+        """
+        num_sites = placement.num_sites
+        num_workers = max(1, min(num_workers, num_sites))
+        size = (num_sites + num_workers - 1) // num_workers
+        self.conns = []
+        self.processes = []
+        self.pending = []   #pending[worker] is the batch not sent yet
+        self.waiting = []   #waiting[worker] is the queue of replies not received yet
+        self.site_worker = [0] * (num_sites + 1)
+        for w in range(num_workers):
+            site_ids = list(range(w*size + 1, min((w+1)*size, num_sites) + 1))
+            if len(site_ids) == 0:
+                break
+            for i in site_ids:
+                self.site_worker[i] = len(self.conns)
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve, daemon=True,
+                args=(child, site_ids, num_sites, placement.num_vars, rule))
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+            self.pending.append([])
+            self.waiting.append(collections.deque())
+
+    def send(self, site_id, msg):
+        """
+        queue a message without result
+        input: site id, message
+        output: None
+        side effect: None
+        """
+        self.pending[self.site_worker[site_id]].append(msg)
+
+    def request(self, site_id, msg):
+        """
+        queue a message with a result
+        input: site id, message
+        output: Reply
+        side effect: None
+        """
+        worker = self.site_worker[site_id]
+        reply = Reply(self, worker)
+        self.pending[worker].append(msg)
+        self.waiting[worker].append(reply)
+        return reply
+
+    def flush(self):
+        """
+        send the queued batches of all workers
+        input: None
+        output: None
+        side effect: None
+        """
+        for w in range(len(self.conns)):
+            if len(self.pending[w]) > 0:
+                self.conns[w].send(self.pending[w])
+                self.pending[w] = []
+
+    def wait(self, reply):
+        """
+        receive results of a worker until a reply is done
+        input: reply
+        output: None
+        side effect: earlier replies of the same worker are done too
+        """
+        self.flush()
+        waiting = self.waiting[reply.worker]
+        while not reply.done:
+            for value in self.conns[reply.worker].recv():
+                done = waiting.popleft()
+                done.value = value
+                done.done = True
+
+    def close(self):
+        """
+        stop the workers
+        input: None
+        output: None
+        side effect: None
+        """
+        self.flush()
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.conns = []
+        self.processes = []
+
+
+class DeferredSink(NullSink):
+    """
+    DeferredSink class, output of a TransactionManager with workers: the value of a read of a
+    read-write transaction arrives with a later batch of results instead of being waited for,
+    the events after a held read are held too so the output keeps its order
+    """
+    def __init__(self, output, held=HELD):
+        """
+        input: sink the events are given to, most reads held back
+        output: None
+        side effect: None
+        """
+        self.output = output
+        self.held = held
+        self.events = collections.deque() #[(<function:method of output>, args)], method None for a held read
+        self.reads = 0                    #held reads
+
+    def hold(self, method, args):
+        """
+        give an event to the output, or hold it behind a held read
+        input: method of the output, its arguments
+        output: None
+        side effect: None
+        """
+        if len(self.events) == 0:
+            method(*args)
+        else:
+            self.events.append((method, args))
+
+    def read_reply(self, trans_id, var, site_id, reply):
+        """
+        hold a read until its value arrives
+        input: trans id, variable, site read, Reply of READ_LATEST
+        output: None
+        side effect: the oldest held read is waited for when too many are held
+        """
+        self.events.append((None, (trans_id, var, site_id, reply)))
+        self.reads += 1
+        self.give(self.held)
+
+    def give(self, held):
+        """
+        give the held events to the output in order, up to a read whose value did not arrive
+        input: reads that may stay held
+        output: None
+        side effect: the oldest held reads are waited for until at most held are left
+        """
+        events = self.events
+        while len(events) > 0:
+            method, args = events[0]
+            if method is not None:
+                method(*args)
+            elif args[3].done or self.reads > held:
+                version, value = args[3].result()
+                self.reads -= 1
+                self.output.read(args[0], args[1], value, args[2], None if version == OWN_WRITE else version)
+            else:
+                return
+            events.popleft()
+
+    def began(self, trans_id, kind, time):
+        """
+        give the begin of a transaction to the output(see NullSink.began), after the held events
+        """
+        self.hold(self.output.began, (trans_id, kind, time))
+
+    def read(self, trans_id, var, value, site_id=None, version=None):
+        """
+        give a read whose value is known to the output(see NullSink.read), after the held events
+        """
+        self.hold(self.output.read, (trans_id, var, value, site_id, version))
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        """
+        give a commit to the output(see NullSink.committed), after the held events
+        """
+        self.hold(self.output.committed, (trans_id, time, writes, sites))
+
+    def aborted(self, trans_id, cause):
+        """
+        give an abort to the output, after the held events
+        """
+        self.hold(self.output.aborted, (trans_id, cause))
+
+    def site_failed(self, site_id):
+        """
+        give a site failure to the output, after the held events
+        """
+        self.hold(self.output.site_failed, (site_id,))
+
+    def site_recovered(self, site_id):
+        """
+        give a site recovery to the output, after the held events
+        """
+        self.hold(self.output.site_recovered, (site_id,))
+
+    def dump_site(self, site_id, values):
+        """
+        give the values of a site to the output, after the held events
+        """
+        self.hold(self.output.dump_site, (site_id, values))
+
+    def dump_var(self, var, values):
+        """
+        give the values of a variable at its sites to the output, after the held events
+        """
+        self.hold(self.output.dump_var, (var, values))
+
+    def flush(self):
+        """
+        give every held event to the output, waiting for the held reads, and flush it
+        input: None
+        output: None
+        side effect: None
+        """
+        self.give(0)
+        self.output.flush()
+
+
+class WaitersOf:
+    """
+    transactions to resume after a commit at a remote site, found when iterated
+    """
+    def __init__(self, site, reply):
+        self.site = site
+        self.reply = reply
+
+    def __iter__(self):
+        #a set built in the same order as Site.commit_trans, so it iterates the same
+        waiters = set()
+        for var in self.reply.result():
+            waiters.update(self.site.replicas.written(var, self.site.siteid))
+        return iter(waiters)
+
+
+class RemoteSite:
+    """
+    RemoteSite class, stands for a Site living in a worker process, with the same
+    interface as Site for the TransactionManager
+    the request_ methods give the Reply without waiting, to ask many sites before the first answer
+    """
+    def __init__(self, ID, pool, replicas):
+        """
+        input: site id, WorkerPool, readable replica index of the coordinator
+        output: None
+        side effect: None
+        """
+        self.siteid = ID
+        self.status = "ON" #kept here too, only fail and recover change it
+        self.stale = True  #some replicated copy may not be readable, a commit then reports the copies it makes readable
+        self.pool = pool
+        self.replicas = replicas
+
+    def write(self, trans_id, var, value):
+        """
+        buffer a write at the site(see Site.write)
+        input: trans_id, variable, value
+        output: None
+        side effect: None
+        """
+        self.pool.send(self.siteid, (WRITE, self.siteid, trans_id, var, value))
+
+    def finish(self, trans_id, commit, time, watermark):
+        """
+        commit or abort a transaction at the site(see Site.finish), the copies it makes readable
+        are only asked for while some copy of the site may not be readable
+        input: trans_id, True to commit, end time, watermark
+        output: WaitersOf the transactions to resume, or None
+        side effect: None
+        """
+        if self.stale and commit:
+            self.stale = not self.replicas.complete(self.siteid)
+        if not commit or not self.stale:
+            #nothing to wait for, no copy of the site can become readable
+            self.pool.send(self.siteid, (FINISH, self.siteid, trans_id, commit, time, watermark, False))
+            return None
+        msg = (FINISH, self.siteid, trans_id, commit, time, watermark, True)
+        return WaitersOf(self, self.pool.request(self.siteid, msg))
+
+    def version_before(self, var, time):
+        """
+        get the last version of a variable committed before a given time(see Site.version_before)
+        input: variable, time
+        output: (commit time, value)
+        side effect: None
+        """
+        return self.request_version_before(var, time).result()
+
+    def request_version_before(self, var, time):
+        """
+        ask for the last version of a variable committed before a given time
+        input: variable, time
+        output: Reply of (commit time, value)
+        side effect: None
+        """
+        return self.pool.request(self.siteid, (VERSION_BEFORE, self.siteid, var, time))
+
+    def read_latest(self, trans_id, var):
+        """
+        read a variable with the version of the value(see Site.read_latest)
+        input: trans_id, variable
+        output: (commit time, value)
+        side effect: None
+        """
+        return self.request_read_latest(trans_id, var).result()
+
+    def request_read_latest(self, trans_id, var):
+        """
+        ask for a variable with the version of the value
+        input: trans_id, variable
+        output: Reply of (commit time, value)
+        side effect: None
+        """
+        return self.pool.request(self.siteid, (READ_LATEST, self.siteid, trans_id, var))
+
+    def version_chain(self, var):
+        """
+        get the committed versions of a variable(see Site.version_chain)
+        input: variable
+        output: (commit times, values)
+        side effect: None
+        """
+        return self.pool.request(self.siteid, (VERSION_CHAIN, self.siteid, var)).result()
+
+    def catch_up(self, var, times, values):
+        """
+        install the committed versions of a replicated variable(see Site.catch_up)
+        input: variable, commit times, values
+        output: transactions waiting for the copy to become readable
+        side effect: None
+        """
+        self.pool.send(self.siteid, (CATCH_UP, self.siteid, var, times, values))
+        return self.replicas.written(var, self.siteid)
+
+    def get(self, var):
+        """
+        get the committed value of a variable
+        input: variable
+        output: value
+        side effect: None
+        """
+        return self.pool.request(self.siteid, (GET, self.siteid, var)).result()
+
+    def items(self):
+        """
+        get all committed values
+        input: None
+        output: list of (variable, value) in variable order
+        side effect: None
+        """
+        return self.pool.request(self.siteid, (ITEMS, self.siteid)).result()
+
+    def columns(self):
+        """
+        get the committed state of the site as arrays(see Site.columns)
+        input: None
+        output: (variables, values, read_available), copies
+        side effect: None
+        """
+        return self.pool.request(self.siteid, (COLUMNS, self.siteid)).result()
+
+    def dump(self, output):
+        """
+        give the committed values of the site to the output
+        input: output sink
+        output: None
+        side effect: None
+        """
+        output.dump_site(self.siteid, self.items())
+
+    def failed(self):
+        """
+        fail the site(see Site.failed), its copies may not be readable once it recovers
+        input: None
+        output: None
+        side effect: None
+        """
+        self.status = "OFF"
+        self.stale = True
+        self.pool.send(self.siteid, (FAIL, self.siteid))
+
+    def recovered(self):
+        """
+        recover the site(see Site.recovered)
+        input: None
+        output: None
+        side effect: None
+        """
+        self.status = "ON"
+        self.stale = True
+        self.pool.send(self.siteid, (RECOVER, self.siteid))
@@ -1,14 +1,6 @@
 #!/bin/bash
-
-rm -rf output 
-mkdir output
-count=1
-for filename in `ls test/* | sort -V`; do
-    file=$(basename "$filename")
-    (python3 main.py -f $filename) &> output/run_$file
-    echo res/res$count output/run_$file
-    if diff res/res$count output/run_$file; then
-        echo "run_$filename pass"
-    fi
-    (( count++ ))
-done
\ No newline at end of file
+# run every scenario in test/ and compare it with res/, in-process and through a
+# loopback server, see regress.py
+python3 regress.py "$@" && \
+python3 regress.py "$@" --loopback && \
+python3 regress.py "$@" --loopback --tests test/loopback --expected res/loopback
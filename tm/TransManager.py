@@ -1,77 +1,269 @@
-from sites.site import Site
-from trans.transaction import Transaction
-from trans.op import Op
 import collections
+from sites.site import Site, OWN_WRITE
+from sites.worker import WorkerPool, RemoteSite, DeferredSink
+from sites.placement import Placement
+from sites.replica import ReplicaIndex, low_bit
+from trans.transaction import Transaction, History
+from tm.waitgraph import WaitForGraph, NullWaitGraph
+from tm.metrics import Metrics, NullMetrics
+from tm.output import TextSink
+from tm.wal import NullLog
+from tm.state import cluster_state
+from sites.lock import LockTable, dequeue
+
+#detect: abort the youngest transaction on a wait-for cycle
+#wait-die: a younger transaction that has to wait for an older one aborts
+#wound-wait: an older transaction that has to wait for a younger one aborts it
+DEADLOCK_POLICIES = ("detect", "wait-die", "wound-wait")
+#available-copies: write all up copies, read any readable one
+#quorum: write W up copies, read R up copies and keep the newest version, R + W > copies
+PROTOCOLS = ("available-copies", "quorum")
+#2pl: read-write transactions lock what they read and write
+#snapshot: read-write transactions read the versions committed before they began without locks,
+#the first committer of a variable wins, later committers that began before it abort
+ISOLATION_LEVELS = ("2pl", "snapshot")
+
 class TransactionManager:
     """
     Transaction Manager
     Author: Yiming Li & Xinsen Lu
     """
-    def __init__(self):
+    def __init__(self, num_sites=10, num_vars=20, replication="default", metrics=False, output=None,
+                 deadlock="detect", replica_selection="lowest", wal=None,
+                 workers=0, protocol="available-copies", read_quorum=0, write_quorum=0,
+                 catch_up=0, isolation="2pl", history=None):
         """
         create new sites and initialize all variables in each site
         append sites to site_list
-        input: None
+        input: number of sites, number of variables, replication rule(see sites.placement.RULES),
+            whether to collect metrics, output sink(see tm.output, buffered text on stdout by default),
+            deadlock policy(see DEADLOCK_POLICIES), which copy replicated reads go to(see sites.replica.SELECTIONS),
+            commit log(see tm.wal, nothing is kept by default),
+            number of worker processes holding the sites(see sites.worker, 0 keeps them in this process),
+            replication protocol(see PROTOCOLS), quorum sizes for replicated variables
+            (0 for a majority of writes and the smallest read quorum overlapping it),
+            replicated copies of recovered sites copied from an up-to-date copy per command(0 for none,
+            they wait for a write), isolation of read-write transactions(see ISOLATION_LEVELS),
+            most outcomes of finished transactions kept to reject a reused trans id(None for all)
         output: None
-        side effect: site_list in TM will have all info of 10 sites
+        side effect: site_list in TM will have all info of the sites
         """
-        self.trans_list = dict()    #{<str:transid>: Transaction}}
-        self.site_list = [Site(0)]     #site list
-        for i in range(10):
-            new_site = Site(i+1)
+        self.trans_list = dict()    #running transactions {<str:transid>: Transaction}}
+        self.history = History(history) #outcomes of the finished transactions(see trans.transaction.History)
+        self.metrics = Metrics() if metrics else NullMetrics()
+        self.wal = NullLog() if wal is None else wal
+        self.now = -1 #tick of the current command, commands are numbered across loadCommand calls
+        self.placement = Placement(num_sites, num_vars, replication)
+        self.locks = LockTable(self.metrics, deadlock) #locks of all sites
+        self.replicas = ReplicaIndex(self.placement, replica_selection, self.site_load) #readable copies
+        self.site_list = [Site(0, self.placement, self.replicas)]     #site list
+        self.pool = None
+        if workers > 0:
+            if wal is not None:
+                raise ValueError("The commit log needs the sites in this process, it cannot be used with workers.")
+            self.pool = WorkerPool(workers, self.placement, replication)
+        for i in range(num_sites):
+            if self.pool is None:
+                new_site = Site(i+1, self.placement, self.replicas)
+            else:
+                new_site = RemoteSite(i+1, self.pool, self.replicas)
             self.site_list.append(new_site)
-        self.wait_list = dict() #wait table{<int:variable>:[transaction]}
-        self.block_list = dict() #{<str:transid>:set(transid)}
+        self.set_output(TextSink() if output is None else output)
+        self.wait_list = dict() #wait table{<int:variable>:WaitQueue}, only variables with waiters
+        #wait-for edges between transactions, only deadlock detection needs them
+        self.wait_graph = WaitForGraph() if deadlock == "detect" else NullWaitGraph()
+        self.ro_list = dict() #running transactions reading versions(read-only, and read-write with snapshot
+                              #isolation) {<str:transid>:<int:begin time>}, oldest first
+        if deadlock not in DEADLOCK_POLICIES:
+            raise ValueError("Unknown deadlock policy {}.".format(deadlock))
+        self.deadlock = deadlock
+        if isolation not in ISOLATION_LEVELS:
+            raise ValueError("Unknown isolation level {}.".format(isolation))
+        self.isolation = isolation
+        self.snapshot_writes = dict() #writes of running snapshot transactions {<str:transid>:{<int:variable>:<int:value>}}
+        self.last_commit = dict() #time of the last commit writing each variable, snapshot isolation only
+                                 #format {<int:variable>:<int:commit time>}
+        self.catch_up_budget = catch_up
+        self.recovering = dict() #replicated copies of recovered sites not caught up yet {<int:site id>:deque(<int:variable>)}
+        self.catch_up_locked = dict() #pending copies of write-locked variables, tried again on unlock
+                                      #format {<int:variable>:[<int:site id>...]}
+        if protocol not in PROTOCOLS:
+            raise ValueError("Unknown replication protocol {}.".format(protocol))
+        self.protocol = protocol
+        self.read_quorum = read_quorum
+        self.write_quorum = write_quorum
+        if protocol == "quorum":
+            for copies in set(len(self.placement.sites_of(var)) for var in range(1, num_vars+1)):
+                r, w = self.quorum(copies)
+                if copies > 1 and (r > copies or w > copies or r + w <= copies):
+                    raise ValueError("Read quorum {} and write quorum {} do not overlap for {} copies.".format(
+                        r, w, copies))
+        #command handlers indexed by opcode, in the order of trans.op
+        self.dispatch = [self.cmd_begin, self.cmd_begin_ro, self.cmd_end, self.cmd_fail,
+                         self.cmd_recover, self.cmd_dump, self.cmd_read, self.cmd_write]
 
     def loadCommand(self, commands):
         """
-        read iteration commands from input and call the corresponding function
+        read op records from input and call the corresponding function
         Author: Xinsen Lu
-        input: command iterator
+        input: iterator of op records (opcode, trans id, variable, value), see trans.op
+        output: None
+        side effect: Depending on inputs it will have different effects, buffered output is flushed
+        """
+        dispatch = self.dispatch
+        tick = self.wal.tick
+        try:
+            for index, command in enumerate(commands, self.now + 1):
+                self.now = index
+                self.metrics.now = index
+                dispatch[command[0]](command, index)
+                if self.recovering:
+                    self.catch_up(index)
+                tick(index)
+        except Exception:
+            #the output of the commands that ran comes before the error
+            self.output.flush()
+            raise
+        self.wal.flush()
+        self.output.flush()
+
+    def cmd_begin(self, command, index):
+        """
+        begin(T), begin a read-write transaction
+        input: op record, command index(begin time)
         output: None
-        side effect: Depending on inputs it will have different effects
-        """
-        for index, command in enumerate(commands):
-            operation = command[0]
-            args = command[1]
-            if operation == "begin":
-                res = self.begin(args[0], "RW", index)
-                if not res:
-                    raise ValueError(
-                        "Fail to begin {} from command with transactin id {}.".format(operation,args[0]))
-            elif operation == "beginRO":
-                res = self.begin(args[0], "RO", index)
-                if not res:
-                    raise ValueError(
-                        "Fail to begin {} from command with transactin id {}.".format(operation,args[0]))
-            elif operation == "end":
-                _  = self.end(args[0], index)
-                self.check_deadlock(index)
-            elif operation == "fail":
-                self.fail(int(args[0]))
-            elif operation == "recover":
-                self.recover(int(args[0]))
-            elif operation == "dump":
-                self.dump()
-            elif operation == "R":
-                if len(args) != 2:
-                    raise ValueError(
-                        "Not enough args for read.")
-                trans = self.trans_list[args[0]]
-                trans.op = Op("R", int(args[1][1:]), args[0])
-                self.read(args[0])
-                self.check_deadlock(index)
-            elif operation == "W":
-                if len(args) != 3:
-                    raise ValueError(
-                        "Not enough args for write.")
-                trans = self.trans_list[args[0]]
-                trans.op = Op("W", int(args[1][1:]), args[0], args[2])
-                self.write(args[0])
-                self.check_deadlock(index)
+        side effect: ValueError if the transaction already exists
+        """
+        if not self.begin(command[1], "RW", index):
+            raise ValueError(
+                "Fail to begin {} from command with transactin id {}.".format("begin", command[1]))
+
+    def cmd_begin_ro(self, command, index):
+        """
+        beginRO(T), begin a read-only transaction
+        input: op record, command index(begin time)
+        output: None
+        side effect: ValueError if the transaction already exists
+        """
+        if not self.begin(command[1], "RO", index):
+            raise ValueError(
+                "Fail to begin {} from command with transactin id {}.".format("beginRO", command[1]))
+
+    def cmd_end(self, command, index):
+        """
+        end(T), commit or abort a transaction, the outcome of one already ended is given again
+        input: op record, command index
+        output: None
+        side effect: the transactions waiting for it may resume
+        """
+        if command[1] not in self.trans_list:
+            #already ended, e.g. as a deadlock victim, its outcome is given again
+            outcome = self.finished(command[1])
+            if outcome.status == Transaction.COMMITTED:
+                self.output.committed(command[1])
             else:
-                raise ValueError(
-                "Cannot identify operation {} from command".format(operation))
+                self.output.aborted(command[1], outcome.abort_cause)
+            self.history.close(command[1])
+            return
+        _  = self.end(command[1], index)
+        self.history.close(command[1])
+        self.check_deadlock(index)
+
+    def cmd_fail(self, command, index):
+        """
+        fail(site)
+        input: op record, command index
+        output: None
+        side effect: ValueError for an unknown site
+        """
+        self.check_site(command[3])
+        self.fail(command[3])
+
+    def cmd_recover(self, command, index):
+        """
+        recover(site)
+        input: op record, command index
+        output: None
+        side effect: ValueError for an unknown site
+        """
+        self.check_site(command[3])
+        self.recover(command[3])
+
+    def cmd_dump(self, command, index):
+        """
+        dump(), give the committed values of all sites to the output
+        input: op record, command index
+        output: None
+        side effect: None
+        """
+        self.dump()
+
+    def cmd_read(self, command, index):
+        """
+        R(T, x), a command of a waiting transaction replaces the one it waits with
+        input: op record, command index
+        output: None
+        side effect: ValueError for an unknown variable
+        """
+        self.check_var(command[2])
+        if command[1] not in self.trans_list:
+            #operations of an ended transaction are ignored
+            _ = self.finished(command[1])
+            return
+        if self.trans_list[command[1]].waiting is not None or self.replicas.is_waiting(command[1]):
+            self.leave(command[1])
+        self.trans_list[command[1]].set_op("R", command[2])
+        self.read(command[1])
+        self.check_deadlock(index)
+
+    def cmd_write(self, command, index):
+        """
+        W(T, x, v), a command of a waiting transaction replaces the one it waits with
+        input: op record, command index
+        output: None
+        side effect: ValueError for an unknown variable
+        """
+        self.check_var(command[2])
+        if command[1] not in self.trans_list:
+            _ = self.finished(command[1])
+            return
+        if self.trans_list[command[1]].waiting is not None or self.replicas.is_waiting(command[1]):
+            self.leave(command[1])
+        self.trans_list[command[1]].set_op("W", command[2], command[3])
+        self.write(command[1])
+        self.check_deadlock(index)
+
+    def check_var(self, var):
+        """
+        check that a variable of a command exists
+        input: variable
+        output: None
+        side effect: ValueError if it does not
+        """
+        if not 0 < var <= self.placement.num_vars:
+            raise ValueError("Unknown variable x{} from command.".format(var))
+
+    def check_site(self, site_id):
+        """
+        check that a site of a command exists
+        input: site id
+        output: None
+        side effect: ValueError if it does not
+        """
+        if not 0 < site_id < len(self.site_list):
+            raise ValueError("Unknown site {} from command.".format(site_id))
+
+    def finished(self, transid):
+        """
+        get the outcome of a transaction that is not running
+        input: trans id
+        output: Outcome(see trans.transaction)
+        side effect: KeyError if the transaction is unknown, or forgotten by a bounded history
+        """
+        outcome = self.history.get(transid)
+        if outcome is None:
+            raise KeyError(transid)
+        return outcome
 
     def dump(self, var = -1):
         """
@@ -85,141 +277,191 @@ class TransactionManager:
         """
         if var != -1:
             #output based on variable
-            print("x{} - ".format(var), end = " ")
-            for i in range(1,11):
-                if self.site_list[i].variable[var-1] is not None:
-                    print("site{}: {};".format(i, self.site_list[i].variable[var-1]), end = " ")
-            print()
+            self.output.dump_var(var, [(i, self.site_list[i].get(var)) for i in self.placement.sites_of(var)])
         else:
-            for i in range(1,11):
-                self.site_list[i].dump()
+            for i in range(1, len(self.site_list)):
+                self.site_list[i].dump(self.output)
+
+    def state(self):
+        """
+        get the committed values of all copies as sites x variables arrays(needs numpy)
+        input: None
+        output: ClusterState(see tm.state)
+        side effect: None
+        """
+        return cluster_state(self.site_list, self.placement.num_vars)
 
     def read(self, transid):
         """
         read a value from available sites
         input: trans id
         output: the value of the variable
-        side effect: access lock, or add to wait_list and block_list
+        side effect: access lock, or add to wait_list and wait_graph
         """
         if self.trans_list[transid].ifabort:
+            self.leave(transid)
             return
         var = self.trans_list[transid].op.var
+        sites = self.placement.sites_of(var)
         if self.trans_list[transid].type == "RO":
             #read only transaction
-            roval = -1
-            for i in range(1,11):
-                if self.site_list[i].status == "ON":
-                    if self.site_list[i].variable[var-1] == None:
-                        continue
-                    else:
-                        keys = list(self.site_list[var%10+1].pre_version.keys())
-                        for j in reversed(keys):
-                            if j < self.trans_list[transid].time:
-                                key = j
-                                break
-                        roval = self.site_list[var%10+1].pre_version[key][var-1]
-                        break
-            if roval == -1:
-                self.trans_list[transid].ifabort = True
+            version = self.read_snapshot(var, sites, self.trans_list[transid].time)
+            if version is None:
+                self.trans_list[transid].set_abort("no available copy")
+            else:
+                self.output.read(transid, var, version[1], version[2], version[0])
+        elif transid in self.snapshot_writes:
+            #snapshot isolation, no lock, a transaction sees its own writes
+            writes = self.snapshot_writes[transid]
+            if var in writes:
+                self.output.read(transid, var, writes[var])
+                return
+            version = self.read_snapshot(var, sites, self.trans_list[transid].time)
+            if version is None:
+                self.trans_list[transid].set_abort("no available copy")
             else:
-                print("x{}:{}".format(var,roval))
+                self.output.read(transid, var, version[1], version[2], version[0])
         else: #read write transaction
-            if var % 2 != 0: #odd variable
-                if self.site_list[var%10+1].status == "ON":
-                    if self.site_list[var%10+1].lock(self.trans_list[transid], self.wait_list, self.block_list):
-                        val = self.site_list[var%10+1].variable[var-1]
-                        print("x{}:{}".format(var,val))
+            if len(sites) == 1: #not replicated
+                if self.site_list[sites[0]].status == "ON":
+                    if self.locks.lock(self.trans_list[transid], self.wait_list, self.wait_graph, sites):
+                        self.read_latest(transid, var, sites[0])
                 else:
-                    self.trans_list[transid].ifabort = True
-            else: # even variable
-                abortFlag = False
-                readFlag = False
-                idx = -1
-                for i in range(1,11):
-                    if self.site_list[i].status =="ON":
-                        abortFlag = True
-                        if self.site_list[i].check_lock(self.trans_list[transid], self.wait_list):
-                            if self.site_list[i].read_available[(var-1)//2] == False:
-                                idx = i
-                                continue
-                            self.site_list[i].lock(self.trans_list[transid], self.wait_list, self.block_list)
-                            val = self.site_list[i].variable[var-1]
-                            print("x{}:{}".format(var,val))
-                            readFlag = True
-                            break
-                if not abortFlag:
-                    self.trans_list[transid].ifabort = True
+                    self.trans_list[transid].set_abort("no available copy")
+            elif self.protocol == "quorum":
+                trans = self.trans_list[transid]
+                copies = self.up_quorum(sites, self.quorum(len(sites))[0])
+                if copies is None:
+                    trans.set_abort("no read quorum")
+                elif self.locks.lock(trans, self.wait_list, self.wait_graph, copies):
+                    #the read quorum overlaps the copies of the last write, its version is the newest
+                    version, val, i = max(self.ask(copies, "read_latest", transid, var))
+                    self.output.read(transid, var, val, i, None if version == OWN_WRITE else version)
+            else: # replicated variable
+                trans = self.trans_list[transid]
+                i = self.replicas.select(var)
+                if i != -1:
+                    if self.locks.lock(trans, self.wait_list, self.wait_graph, (i,)):
+                        self.read_latest(transid, var, i)
                     return
-                if not readFlag:
-                    if idx == -1:
-                        for i in range(1,11):
-                            if self.site_list[i].status =="ON":
-                                self.site_list[i].lock(self.trans_list[transid], self.wait_list, self.block_list)
-                                break
-                    else:
-                        if var not in self.site_list[idx].recovered_map:
-                            self.site_list[idx].recovered_map[var] = []
-                        self.site_list[idx].recovered_map[var].append(transid)
+                #no copy can be read, wait for a write to a recovered copy or for the lock
+                for i in sites:
+                    if self.site_list[i].status == "ON":
+                        if self.locks.check_lock(trans, self.wait_list, (i,)):
+                            if trans.waiting is not None:
+                                #woken at the head of the lock queue, it would block the queue
+                                self.leave(transid)
+                            self.replicas.wait(var, transid)
+                        else:
+                            self.locks.lock(trans, self.wait_list, self.wait_graph, (i,))
+                        return
+                trans.set_abort("no available copy")
+
+    def read_latest(self, transid, var, site_id):
+        """
+        read the last committed value of a variable at a locked copy, or the transaction's own write
+        input: trans id, variable, site id
+        output: None
+        side effect: the value is given to the output with the site and its version
+        """
+        if self.pool is not None:
+            #only the output needs the value, it is not waited for
+            self.output.read_reply(transid, var, site_id, self.site_list[site_id].request_read_latest(transid, var))
+            return
+        version, val = self.site_list[site_id].read_latest(transid, var)
+        self.output.read(transid, var, val, site_id, None if version == OWN_WRITE else version)
+
+    def ask(self, sites, name, *args):
+        """
+        get a version of a variable from some sites, with workers every site is asked
+        before the first answer is waited for
+        input: site ids, read_latest(trans id, variable) or version_before(variable, time), its arguments
+        output: [(commit time, value, site id)], in the order of the sites
+        side effect: None
+        """
+        if self.pool is None:
+            site_list = self.site_list
+            if name == "version_before":
+                return [site_list[i].version_before(*args) + (i,) for i in sites]
+            return [site_list[i].read_latest(*args) + (i,) for i in sites]
+        replies = [getattr(self.site_list[i], "request_" + name)(*args) for i in sites]
+        return [reply.result() + (i,) for reply, i in zip(replies, sites)]
+
+    def read_snapshot(self, var, sites, time):
+        """
+        read the last value of a variable committed before a given time
+        a copy of a replicated variable misses the commits made while its site was down, even one
+        readable again after a recovery, and a failed site keeps its versions: the version is the
+        newest one at any copy, read from an up copy holding it
+        input: variable, sites holding it, time
+        output: (commit time, value, site id), None if no copy can be read
+        side effect: None
+        """
+        if len(sites) > 1 and self.protocol == "quorum":
+            copies = self.up_quorum(sites, self.quorum(len(sites))[0])
+            if copies is None:
+                return None
+            return max(self.ask(copies, "version_before", var, time))
+        versions = self.ask(sites, "version_before", var, time)
+        latest = max(versions)[0]
+        for version in versions:
+            if version[0] == latest and self.site_list[version[2]].status == "ON":
+                return version
+        return None
 
     def write(self, transid):
         """
         write a value to a variable, or cannot access lock
         input: transaction ID(string)
         output: None
-        side effect: value written to buffer, or add to wait_list and block_list
+        side effect: value written to buffer, or add to wait_list and wait_graph
         """
         if self.trans_list[transid].ifabort:
+            self.leave(transid)
             return
         var = self.trans_list[transid].op.var
         val = self.trans_list[transid].op.value
-        op_ty  = self.trans_list[transid].op.op_type
-        add_buf = {}
-        add_buf[var] = val
-        if var % 2 != 0: #odd variable
-            if self.site_list[var%10+1].status == "ON":
-                if self.site_list[var%10+1].lock(self.trans_list[transid], self.wait_list, self.block_list):
-                    if transid not in self.site_list[var%10+1].buffer:#???
-                        self.site_list[var%10+1].buffer[transid] = {}
-                        self.site_list[var%10+1].buffer[transid] = add_buf
-                    else:
-                        self.site_list[var%10+1].buffer[transid].add(var, val)
+        sites = self.placement.sites_of(var)
+        if transid in self.snapshot_writes:
+            #snapshot isolation, no lock, conflicts are found when the transaction ends
+            if len(sites) > 1 and self.protocol == "quorum":
+                copies = self.up_quorum(sites, self.quorum(len(sites))[1])
             else:
-                self.trans_list[transid].ifabort = True
-        else: #even variable
-            flag = True
-            index = 0
-            for i in range(1,11):
-                if self.site_list[i].status == "OFF":
-                    continue
-                else:
-                    if not self.site_list[i].check_lock(self.trans_list[transid], self.wait_list):
-                        flag = False
-                        index = i
-                        break
-            # print(self.site_list[index].locktable)
-            # print(flag, index)
-            if not flag:
-                #add to wait list and block list
-                self.site_list[index].lock(self.trans_list[transid], self.wait_list, self.block_list)
+                copies = tuple(i for i in sites if self.site_list[i].status == "ON")
+            if copies is None or len(copies) == 0:
+                self.trans_list[transid].set_abort("no available copy")
+                return
+            self.snapshot_writes[transid][var] = val
+            self.trans_list[transid].writes.add(var)
+            self.trans_list[transid].sites.update(copies)
+            for i in copies:
+                self.site_list[i].write(transid, var, val)
+        elif len(sites) == 1: #not replicated
+            site = self.site_list[sites[0]]
+            if site.status == "ON":
+                if self.locks.lock(self.trans_list[transid], self.wait_list, self.wait_graph, sites):
+                    self.trans_list[transid].writes.add(var)
+                    site.write(transid, var, val)
             else:
-                for i in range(1,11):
-                    if self.site_list[i].status == "OFF":
-                        continue
-                    else:
-                        locktable = self.site_list[i].locktable
-                        if var not in locktable:
-                            locktable[var] = [op_ty,set([transid])]
-                        else:
-                            if transid not in locktable[var][1]:
-                                locktable[var][1].add(transid)
-                        if transid in self.site_list[i].buffer:
-                            self.site_list[i].buffer[transid][var] = val
-                        else:
-                            self.site_list[i].buffer[transid] = {}
-                            self.site_list[i].buffer[transid][var] = val
-                if var in self.wait_list:
-                    if self.trans_list[transid] in self.wait_list[var]:
-                        self.wait_list[var].pop(0)
+                self.trans_list[transid].set_abort("no available copy")
+        elif self.protocol == "quorum":
+            copies = self.up_quorum(sites, self.quorum(len(sites))[1])
+            if copies is None:
+                self.trans_list[transid].set_abort("no write quorum")
+            elif self.locks.lock(self.trans_list[transid], self.wait_list, self.wait_graph, copies):
+                self.trans_list[transid].writes.add(var)
+                for i in copies:
+                    self.site_list[i].write(transid, var, val)
+        else: #replicated variable
+            #one logical lock for all up copies, then one buffered write per copy
+            up = [i for i in sites if self.site_list[i].status == "ON"]
+            if len(up) == 0:
+                #a commit would report a write no copy holds
+                self.trans_list[transid].set_abort("no available copy")
+            elif self.locks.lock(self.trans_list[transid], self.wait_list, self.wait_graph, up):
+                self.trans_list[transid].writes.add(var)
+                for i in up:
+                    self.site_list[i].write(transid, var, val)
 
     def fail(self, site_id):
         """
@@ -230,11 +472,19 @@ class TransactionManager:
         output: site:<site_id> fails
         side effect: status of transactions from list(trans_to_abort) are set to "ABORTED"
         """
-        trans_to_abort = self.site_list[site_id].failed()
-        print("Site {} fails".format(site_id))
+        self.wal.site_failed(self.now, site_id)
+        self.site_list[site_id].failed()
+        _ = self.recovering.pop(site_id, None)
+        trans_to_abort = self.locks.failed(site_id)
+        self.replicas.failed(site_id)
+        self.output.site_failed(site_id)
+        for transid in self.snapshot_writes:
+            #the buffered writes of snapshot transactions at the site are lost
+            if site_id in self.trans_list[transid].sites:
+                trans_to_abort.append(transid)
         for trans in trans_to_abort:
             t = self.trans_list[trans]
-            t.ifabort = True
+            t.set_abort("site failure")
 
     def recover(self, site_id):
         """
@@ -246,18 +496,141 @@ class TransactionManager:
         side effect: non-replicated variables remain unchanged, replicated variables
                     are read from other up sites
         """
+        self.wal.site_recovered(self.now, site_id)
         self.site_list[site_id].recovered()
-        self.site_list[site_id].read_available = [False]*10
-        print("Site {} recovers".format(site_id))
-        #use option 1 in transproc slide(page 46) to recover the site
-        #for i in range(1,11):
-        #    if i == site_id:
-        #        continue
-        #    if self.site_list[i].status == "ON":
-        #        s = self.site_list[i]
-        #        break
-        #for v in range(2,21,2):
-        #    self.site_list[site_id-1].variable[v-1] = s.variable[v-1]
+        self.output.site_recovered(site_id)
+        if self.catch_up_budget > 0 and self.protocol == "available-copies":
+            #copy the replicated variables from other up sites a few at a time(see catch_up)
+            pending = collections.deque(var for var in self.placement.vars_of(site_id)
+                                        if self.placement.is_replicated(var))
+            if len(pending) > 0:
+                self.recovering[site_id] = pending
+
+    def catch_up(self, index):
+        """
+        copy the committed versions of some replicated variables of recovered sites from
+        a readable copy, at most catch_up_budget variables per command
+        a write-locked variable waits for its unlock, a variable without readable copy
+        is left to the next write, which reaches every up copy
+        input: current time
+        output: None
+        side effect: the copied variables can be read, transactions waiting for them are resumed
+        """
+        budget = self.catch_up_budget
+        resume_list = []
+        for site_id in sorted(self.recovering):
+            pending = self.recovering[site_id]
+            site = self.site_list[site_id]
+            bit = 1 << site_id
+            while budget > 0 and len(pending) > 0:
+                var = pending.popleft()
+                mask = self.replicas.readable[var]
+                if mask & bit:
+                    #written since the recovery
+                    continue
+                entry = self.locks.locktable.get(var)
+                if entry is not None and entry.mode == "W":
+                    #the writer may not have locked this copy, its commit would not reach it
+                    if var not in self.catch_up_locked:
+                        self.catch_up_locked[var] = []
+                    self.catch_up_locked[var].append(site_id)
+                    continue
+                if mask == 0:
+                    continue
+                budget -= 1
+                times, values = self.site_list[low_bit(mask)].version_chain(var)
+                resume_list.extend(site.catch_up(var, times, values))
+            if len(pending) == 0:
+                del self.recovering[site_id]
+            if budget == 0:
+                break
+        for item in resume_list:
+            self.resume(item)
+        if len(resume_list) > 0:
+            self.check_deadlock(index)
+
+    def unpark(self, trans_id):
+        """
+        put the pending copies of the variables a transaction unlocks back in the catch-up queues
+        input: trans id
+        output: None
+        side effect: None
+        """
+        for var in self.locks.trans_locks.get(trans_id, ()):
+            for site_id in self.catch_up_locked.pop(var, ()):
+                if self.site_list[site_id].status == "ON":
+                    if site_id not in self.recovering:
+                        self.recovering[site_id] = collections.deque()
+                    self.recovering[site_id].append(var)
+
+    def quorum(self, copies):
+        """
+        get the quorum sizes of a variable
+        input: number of copies of the variable
+        output: (read quorum, write quorum)
+        side effect: None
+        """
+        w = self.write_quorum if self.write_quorum > 0 else copies // 2 + 1
+        r = self.read_quorum if self.read_quorum > 0 else copies - w + 1
+        return (r, w)
+
+    def up_quorum(self, sites, size):
+        """
+        pick the copies of a quorum, the up sites with the lowest ids
+        input: site ids holding the variable, quorum size
+        output: tuple of site ids, None if too few sites are up
+        side effect: None
+        """
+        copies = tuple(i for i in sites if self.site_list[i].status == "ON")
+        if len(copies) < size:
+            return None
+        return copies[:size]
+
+    def set_output(self, output):
+        """
+        replace the output sink
+        input: sink, see tm.output
+        output: None
+        side effect: with workers the reads are given to it once their values arrive(see sites.worker.DeferredSink),
+            with a commit log the commits once they are synced(see tm.wal.DurableSink)
+        """
+        output = self.wal.durable(output)
+        self.output = output if self.pool is None else DeferredSink(output)
+
+    def close(self):
+        """
+        flush the commit log and stop the workers
+        input: None
+        output: None
+        side effect: None
+        """
+        self.wal.close()
+        #the commits synced by the close
+        self.output.flush()
+        if self.pool is not None:
+            self.pool.close()
+
+    def site_load(self, site_id):
+        """
+        count the locks held at a site
+        input: site id
+        output: number of locks
+        side effect: None
+        """
+        return self.locks.held[site_id]
+
+    def blocked(self, trans_id):
+        """
+        check whether a running transaction waits for a lock or for a readable copy
+        input: trans id
+        output: True/False, False if it is not running
+        side effect: None
+        """
+        trans = self.trans_list.get(trans_id)
+        if trans is None or trans.ifabort:
+            #a transaction that aborts at its end does not run anything anymore
+            return False
+        return trans.waiting is not None or self.replicas.is_waiting(trans_id)
 
     def begin(self, trans_id, trans_type, time):
         """
@@ -268,10 +641,19 @@ class TransactionManager:
         side effect: None
         """
         newTrans = Transaction(trans_id, trans_type, time)
-        if trans_id in self.trans_list:
+        if trans_id in self.trans_list or trans_id in self.history:
             return False
         else:
             self.trans_list[trans_id] = newTrans
+            if trans_type == "RO":
+                self.ro_list[trans_id] = time
+                self.output.began(trans_id, "RO", time)
+            elif self.isolation == "snapshot":
+                self.ro_list[trans_id] = time
+                self.snapshot_writes[trans_id] = dict()
+                self.output.began(trans_id, "SI", time)
+            else:
+                self.output.began(trans_id, "RW", time)
             return True
     def resume(self, trans_id):
         """
@@ -281,7 +663,10 @@ class TransactionManager:
         output: None
         side effect: self effect as read and write
         """
-        trans = self.trans_list[trans_id]
+        trans = self.trans_list.get(trans_id)
+        if trans is None:
+            #ended while it waited for a readable copy
+            return
         op = trans.op
         if op != None:
             if op.op_type == "R":
@@ -297,82 +682,156 @@ class TransactionManager:
         Author: Xinsen Lu
         input: trans_id
         output: transaction commit(True) or abort(Fail)
-        side effect: affact site_list, block_list and wait_list
+        side effect: affact site_list, wait_graph and wait_list
         """
         trans = self.trans_list[trans_id]
         trans.endtime = time
-        #unlock
-        for i in range(1, 11):
-            return_list = self.site_list[i].unlock(trans)
+        _ = self.ro_list.pop(trans_id, None)
+        writes = self.snapshot_writes.pop(trans_id, None)
+        if writes is not None and not trans.ifabort:
+            #first committer wins
+            for var in writes:
+                if self.last_commit.get(var, -1) > trans.time:
+                    trans.set_abort("write conflict")
+                    break
+            else:
+                for var in writes:
+                    self.last_commit[var] = time
+        #versions older than the oldest running read-only transaction are not needed
+        watermark = next(iter(self.ro_list.values()), time)
+        if not trans.ifabort:
+            #the commit is logged before it is applied
+            self.wal.committed(trans, self.site_list)
+        #its own commit could make the copy it waited for readable and resume it
+        self.replicas.cancel(trans_id)
+        #unlock, then commit or drop the writes at the sites the transaction touched
+        if self.catch_up_locked:
+            self.unpark(trans_id)
+        held = self.locks.trans_locks.get(trans_id, ())
+        self.locks.unlock(trans_id)
+        finished = (self.site_list[i].finish(trans_id, not trans.ifabort, time, watermark)
+                    for i in sorted(trans.sites))
+        if self.pool is not None:
+            #send the commits to every worker before waiting for the first one
+            finished = list(finished)
+        for return_list in finished:
             if return_list != None:
                 for item in return_list:
                     self.resume(item)
 
         if not trans.ifabort:
-            print("Transaction {} is commited.".format(trans_id))
+            self.output.committed(trans_id, time, trans.writes, trans.sites)
+            self.metrics.committed(trans)
         else:
-            print("Transaction {} is aborted.".format(trans_id))
+            self.output.aborted(trans_id, trans.abort_cause)
+            self.metrics.aborted(trans)
         
-        # print(self.block_list)
-        #clear block_list
-        resume_list = []
-        for key, value in self.block_list.items():
-            if trans_id in value:
-                self.block_list[key].remove(trans_id)
-                if len(self.block_list[key])==0:
-                    resume_list.append(key)
-
-        # print(resume_list)
-        # print(self.wait_list)
-        #resume
+        #clear wait_graph and wait_list, only the outcome is kept
+        resume_list = self.wait_graph.remove_node(trans_id)
+        waiting = trans.waiting
+        dequeue(self.wait_list, trans)
+        del self.trans_list[trans_id]
+        self.history.add(trans)
+
+        if self.deadlock != "detect":
+            #no wait-for graph tells who waited for it, the queues it held or waited in are woken
+            for var in sorted(held):
+                self.wake(var)
+            if waiting is not None:
+                self.wake(waiting)
+            return not trans.ifabort
+        #resume the waiters that are now at the head of their queue, the others wait
+        #for the ones still before them
+        queues = []
         for item in resume_list:
-            for key, value in self.wait_list.items():
-                if len(value)>0 and value[0].transid == item:
-                    self.resume(item)
+            waiting = self.trans_list[item].waiting
+            if waiting is None:
+                continue
+            if waiting not in queues:
+                queues.append(waiting)
+            if self.wait_list[waiting][0].transid == item:
+                self.resume(item)
+            else:
+                self.locks.rewait(self.trans_list[item], self.wait_list, self.wait_graph)
+        for var in queues:
+            self.wake(var)
         return not trans.ifabort
 
+    def leave(self, trans_id):
+        """
+        stop a transaction from waiting, because it aborts at its end or its next operation
+        replaces the one that waited
+        input: trans id
+        output: None
+        side effect: the ones queued behind it are resumed if they get the lock now
+        """
+        trans = self.trans_list[trans_id]
+        self.replicas.cancel(trans_id)
+        var = trans.waiting
+        if var is None:
+            return
+        dequeue(self.wait_list, trans)
+        self.wait_graph.set_edges(trans_id, ())
+        self.wake(var)
+
+    def wake(self, var):
+        """
+        resume the transactions at the head of a wait queue as long as they get the lock,
+        e.g. the readers queued behind a reader that got it
+        input: variable
+        output: None
+        side effect: None
+        """
+        while var in self.wait_list:
+            head = self.wait_list[var][0]
+            self.resume(head.transid)
+            if head.waiting == var:
+                return
+
 
 
     def check_deadlock(self, index):
+        if self.deadlock != "detect":
+            self.prevent_deadlock(index)
+            return
+        #the waiters of a victim may wait for others now, which can close another cycle
         res = self.detect_deadlock()
-        if len(res) != 0:
-            self.trans_list[res].ifabort = True
+        while len(res) != 0:
+            self.metrics.deadlock(res)
+            self.trans_list[res].set_abort("deadlock")
             self.end(res, index)
+            res = self.detect_deadlock()
 
     def detect_deadlock(self):
         """
-        detect a deadlock
+        detect a deadlock, only cycles through newly added wait-for edges are searched
         Author: Xinsen Lu
         input: None
-        output: trans_id or ""
-        side effect: None
+        output: trans_id of the youngest transaction on a cycle or ""
+            only transactions on the cycle are candidates: one that merely waits for a cycle
+            member is younger maybe, but aborting it does not break the cycle
+        side effect: new edges that are not on a cycle are no longer pending in wait_graph
         """
-        outdeg = collections.defaultdict(int)
-        edges = collections.defaultdict(list)
-        for key in self.trans_list:
-            outdeg[key] = 0
-        for key, item in self.block_list.items():
-            outdeg[key] = len(item)
-            for ele in item:
-                if ele not in edges:
-                    edges[ele] = []
-                edges[ele].append(key)
-        q = []
-        for key, item in outdeg.items():
-            if item == 0:
-                q.append(key)
-        while len(q) >0:
-            tmp = q.pop(0)
-            for item in edges[tmp]:
-                outdeg[item]-=1
-                if outdeg[item]==0:
-                    q.append(item)
         res = ""
-        for key, item in outdeg.items():
-            if item != 0:
-                if len(res) == 0:
+        for key in self.wait_graph.cycle_members():
+            if len(res) == 0:
+                res = key
+            else:
+                if self.trans_list[key].time > self.trans_list[res].time:
                     res = key
-                else:
-                    if self.trans_list[key].time > self.trans_list[res].time:
-                        res = key
         return res
+
+    def prevent_deadlock(self, index):
+        """
+        end the victims of wait-die or wound-wait, chosen when the locks were requested
+        (see sites.lock.LockTable.prevent)
+        input: current time
+        output: None
+        side effect: ending a victim may wake transactions that make new victims, they are ended too
+        """
+        victims = self.locks.victims
+        while len(victims) > 0:
+            victim = victims.pop(0)
+            if victim in self.trans_list:
+                self.metrics.deadlock(victim)
+                self.end(victim, index)
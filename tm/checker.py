@@ -0,0 +1,384 @@
+import argparse
+import bisect
+import collections
+import heapq
+import itertools
+import json
+import sys
+from tm.output import NullSink
+
+REPORTS = 100 #violations kept with their message, the others are only counted
+
+
+class Version:
+    """
+    committed version of a variable
+    """
+    __slots__ = ("time", "writer", "readers")
+
+    def __init__(self, time, writer):
+        self.time = time        #commit time, -1 for the initial value
+        self.writer = writer    #Node, None for the initial value
+        self.readers = set()    #Nodes of the committed transactions that read it
+
+
+class Node:
+    """
+    committed transaction in the multiversion serialization graph
+    """
+    __slots__ = ("transid", "time", "out", "indegree", "read_versions", "live")
+
+    def __init__(self, transid, time):
+        self.transid = transid
+        self.time = time
+        self.out = set()        #Nodes that must follow it
+        self.indegree = 0       #number of live Nodes that must precede it
+        self.read_versions = [] #Versions it read, it is in their readers
+        self.live = True
+
+
+class Running:
+    """
+    running transaction, its reads are kept until it ends
+    """
+    __slots__ = ("kind", "time", "reads")
+
+    def __init__(self, kind, time):
+        self.kind = kind    #"RO", "RW" or "SI", see tm.output.NullSink.began
+        self.time = time
+        self.reads = []     #[(<int:variable>, <int:version>, <int:site id>, <int:failures of the site when read>)]
+
+
+class Checker(NullSink):
+    """
+    Checker class, output sink that checks the history of a TransactionManager while it runs
+    and passes every event on to another sink
+    committed transactions are the nodes of the multiversion serialization graph, a cycle means
+    the history is not serializable(expected for write skew under snapshot isolation); the
+    available copies rules are checked too: a read sees the last committed version(the last one
+    before the begin time for RO and SI transactions), reads and commits only touch up sites, and
+    a read-write transaction does not commit after a site it read from failed
+    a node is dropped once it committed before every running transaction began and no live node
+    precedes it, no later edge can reach it; versions that no running transaction can read are
+    dropped; the memory is not bounded: every node committed since the oldest running transaction
+    began is kept, so one that runs or waits for long(e.g. for a readable copy) keeps the history
+    since then, summary() gives the one that did at the peak
+    """
+    def __init__(self, output=None, reports=REPORTS):
+        """
+        input: sink the events are passed on to(dropped by default), violations kept with their message
+        output: None
+        side effect: None
+        """
+        self.output = NullSink() if output is None else output
+        self.reports = reports
+        self.running = collections.OrderedDict() #{<str:trans id>:Running}, oldest first
+        self.versions = dict() #committed versions of each variable, oldest first
+                               #format {<int:variable>:([<int:commit time>...], [Version...])}
+        self.roots = []        #heap of (commit time, seq, Node), nodes that had no predecessor
+        self.seq = itertools.count()
+        self.failures = collections.Counter() #failures of each site {<int:site id>:<int:count>}
+        self.down = set()      #failed sites
+        self.pending = []      #reads of versions not committed yet [(<str:trans id>, read)], see Running
+        self.violations = []   #messages of the first violations
+        self.num_violations = 0
+        self.commits = 0
+        self.nodes = 0         #live nodes
+        self.peak_nodes = 0
+        self.pinned = None     #(<str:trans id>, <int:begin time>) of the oldest running transaction at the peak
+
+    def violation(self, message):
+        self.num_violations += 1
+        if len(self.violations) < self.reports:
+            self.violations.append(message)
+
+    def chain(self, var):
+        """
+        get the versions of a variable
+        input: variable
+        output: ([<int:commit time>...], [Version...])
+        side effect: the initial version is added the first time
+        """
+        versions = self.versions.get(var)
+        if versions is None:
+            versions = ([-1], [Version(-1, None)])
+            self.versions[var] = versions
+        return versions
+
+    def watermark(self, time):
+        """
+        get the begin time of the oldest running transaction
+        input: current time
+        output: begin time, the next time if no transaction is running
+        side effect: None
+        """
+        for trans in self.running.values():
+            return trans.time
+        return time + 1
+
+    def began(self, trans_id, kind, time):
+        self.output.began(trans_id, kind, time)
+        self.running[trans_id] = Running(kind, time)
+
+    def read(self, trans_id, var, value, site_id=None, version=None):
+        self.output.read(trans_id, var, value, site_id, version)
+        trans = self.running.get(trans_id)
+        if trans is None or version is None:
+            #begun before the checker, or the transaction's own write
+            return
+        if site_id in self.down:
+            self.violation("{} read x{} at failed site {}".format(trans_id, var, site_id))
+        read = (var, version, site_id, self.failures[site_id])
+        if version > self.chain(var)[0][-1]:
+            #a waiter resumed by a commit reads before the commit is given
+            self.pending.append((trans_id, read))
+            return
+        self.add_read(trans_id, trans, read)
+
+    def add_read(self, trans_id, trans, read):
+        """
+        check the version of a read and keep the read until the transaction ends
+        input: trans id, Running, (variable, version, site id, failures of the site)
+        output: None
+        side effect: None
+        """
+        var, version = read[0], read[1]
+        times = self.chain(var)[0]
+        if trans.kind == "RW":
+            expected = times[-1]
+        else:
+            expected = times[bisect.bisect_left(times, trans.time) - 1]
+        if version != expected:
+            self.violation("{} read version {} of x{} instead of {}".format(trans_id, version, var, expected))
+        trans.reads.append(read)
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        self.output.committed(trans_id, time, writes, sites)
+        trans = self.running.pop(trans_id, None) if time is not None else None
+        if trans is None:
+            #outcome given again, or begun before the checker
+            return
+        self.commits += 1
+        for site_id in sites:
+            if site_id in self.down:
+                self.violation("{} committed with failed site {}".format(trans_id, site_id))
+        node = Node(trans_id, time)
+        for var, version, site_id, failures in trans.reads:
+            if trans.kind == "RW" and self.failures[site_id] != failures:
+                self.violation("{} committed after site {} it read from failed".format(trans_id, site_id))
+            times, versions = self.chain(var)
+            idx = bisect.bisect_left(times, version)
+            if idx == len(times) or times[idx] != version:
+                #already reported as a stale read
+                continue
+            #wr: the writer of a version precedes its readers
+            self.edge(versions[idx].writer, node)
+            #rw: a reader precedes the writer of the next version
+            if idx + 1 < len(times):
+                self.edge(node, versions[idx+1].writer)
+            versions[idx].readers.add(node)
+            node.read_versions.append(versions[idx])
+        watermark = self.watermark(time)
+        for var in writes:
+            times, versions = self.chain(var)
+            last = versions[-1]
+            if trans.kind == "SI" and last.time > trans.time:
+                self.violation("{} overwrote x{} committed after it began".format(trans_id, var))
+            #ww: the writer of a version precedes the next writer, and so do its readers
+            self.edge(last.writer, node)
+            for reader in last.readers:
+                self.edge(reader, node)
+            times.append(time)
+            versions.append(Version(time, node))
+            #keep the newest version before the watermark, it is what the oldest reader sees
+            idx = bisect.bisect_left(times, watermark) - 1
+            if idx > 0:
+                del times[:idx]
+                del versions[:idx]
+        pending = self.pending
+        self.pending = []
+        for reader, read in pending:
+            if reader in self.running:
+                self.add_read(reader, self.running[reader], read)
+        self.nodes += 1
+        if self.nodes > self.peak_nodes:
+            self.peak_nodes = self.nodes
+            self.pinned = None
+            for oldest, running in self.running.items():
+                self.pinned = (oldest, running.time)
+                break
+        if node.indegree == 0:
+            heapq.heappush(self.roots, (time, next(self.seq), node))
+        elif len(node.out) > 0:
+            #every new edge touches the new node, so does every new cycle
+            cycle = self.cycle(node)
+            if cycle is not None:
+                self.violation("cycle {}".format(" -> ".join(n.transid for n in cycle)))
+                #the edges out of the node are dropped to break the cycle, or none of its nodes could be dropped
+                for succ in node.out:
+                    succ.indegree -= 1
+                    if succ.indegree == 0:
+                        heapq.heappush(self.roots, (succ.time, next(self.seq), succ))
+                node.out = set()
+        self.prune(watermark)
+
+    def aborted(self, trans_id, cause):
+        self.output.aborted(trans_id, cause)
+        _ = self.running.pop(trans_id, None)
+
+    def site_failed(self, site_id):
+        self.output.site_failed(site_id)
+        self.failures[site_id] += 1
+        self.down.add(site_id)
+
+    def site_recovered(self, site_id):
+        self.output.site_recovered(site_id)
+        self.down.discard(site_id)
+
+    def dump_site(self, site_id, values):
+        self.output.dump_site(site_id, values)
+
+    def dump_var(self, var, values):
+        self.output.dump_var(var, values)
+
+    def flush(self):
+        self.output.flush()
+
+    def edge(self, before, after):
+        """
+        add an edge of the serialization graph
+        input: Node that must precede, Node that must follow
+        output: None
+        side effect: edges from or to dropped nodes, and self loops, are left out
+        """
+        if before is None or before is after or not before.live or not after.live:
+            return
+        if after not in before.out:
+            before.out.add(after)
+            after.indegree += 1
+
+    def cycle(self, node):
+        """
+        find a cycle through a node, depth first
+        input: Node
+        output: list of Nodes from node back to node, None if there is no cycle
+        side effect: None
+        """
+        parent = {node: None}
+        stack = [node]
+        while len(stack) > 0:
+            current = stack.pop()
+            for succ in current.out:
+                if succ is node:
+                    path = [node]
+                    while current is not None:
+                        path.append(current)
+                        current = parent[current]
+                    path.reverse()
+                    return path
+                if succ not in parent:
+                    parent[succ] = current
+                    stack.append(succ)
+        return None
+
+    def prune(self, watermark):
+        """
+        drop the nodes committed before the watermark that no live node precedes
+        input: begin time of the oldest running transaction
+        output: None
+        side effect: the nodes they precede may be dropped too
+        """
+        roots = self.roots
+        while len(roots) > 0 and roots[0][0] < watermark:
+            node = heapq.heappop(roots)[2]
+            if not node.live or node.indegree > 0:
+                continue
+            node.live = False
+            self.nodes -= 1
+            for version in node.read_versions:
+                version.readers.discard(node)
+            for succ in node.out:
+                succ.indegree -= 1
+                if succ.indegree == 0:
+                    heapq.heappush(roots, (succ.time, next(self.seq), succ))
+            node.out = None
+            node.read_versions = None
+
+    def summary(self):
+        """
+        get the results of the check
+        input: None
+        output: dict
+        side effect: None
+        """
+        return {
+            "commits": self.commits,
+            "violations": self.num_violations,
+            "messages": list(self.violations),
+            "peak_nodes": self.peak_nodes,
+            #the oldest running transaction at the peak, the nodes committed since it began were kept
+            "pinned_by": None if self.pinned is None else self.pinned[0],
+            "pinned_since": None if self.pinned is None else self.pinned[1],
+            "nodes": self.nodes,
+            "versions": sum(len(times) for times, _ in self.versions.values()),
+        }
+
+
+EVENTS = {
+    "begin": lambda c, e: c.began(e["trans"], e["kind"], e["time"]),
+    "read": lambda c, e: c.read(e["trans"], e["var"], e["value"], e.get("site"), e.get("version")),
+    "commit": lambda c, e: c.committed(e["trans"], e.get("time"), e.get("writes", ()), e.get("sites", ())),
+    "abort": lambda c, e: c.aborted(e["trans"], e["cause"]),
+    "fail": lambda c, e: c.site_failed(e["site"]),
+    "recover": lambda c, e: c.site_recovered(e["site"]),
+}
+
+def check_events(lines, checker=None):
+    """
+    check a history written by the json output(see tm.output.JsonSink), one event per line
+    input: iterator of lines, Checker(a new one by default)
+    output: Checker
+    side effect: None
+    """
+    checker = Checker() if checker is None else checker
+    for line in lines:
+        if len(line.strip()) == 0:
+            continue
+        event = json.loads(line)
+        handler = EVENTS.get(event["event"])
+        if handler is not None:
+            handler(checker, event)
+    return checker
+
+def pinned(result):
+    """
+    describe the transaction that kept the most nodes
+    input: summary of a Checker
+    output: text, empty if no transaction was running at the peak
+    side effect: None
+    """
+    if result["pinned_by"] is None:
+        return ""
+    return ", kept since {} began at {}".format(result["pinned_by"], result["pinned_since"])
+
+def main():
+    description = "Check a history written by main.py --output json"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('history', nargs='?',
+			help='Json lines history, stdin by default.')
+    args = parser.parse_args()
+    if args.history is None:
+        checker = check_events(sys.stdin)
+    else:
+        with open(args.history) as f:
+            checker = check_events(f)
+    result = checker.summary()
+    for message in result["messages"]:
+        print(message)
+    print("{} commits, {} violations, at most {} nodes{}".format(
+        result["commits"], result["violations"], result["peak_nodes"], pinned(result)))
+    sys.exit(1 if result["violations"] > 0 else 0)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,157 @@
+import collections
+
+
+class Histogram:
+    """
+    Histogram class, counts values in power of two buckets
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = collections.Counter() #{<int:upper bound>:count}, bucket b holds values <= b
+
+    def add(self, value):
+        """
+        add a value
+        input: value(int >= 0)
+        output: None
+        side effect: None
+        """
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        bound = 1
+        while bound < value:
+            bound *= 2
+        self.buckets[bound] += 1
+
+    def to_dict(self):
+        """
+        output: dict with count, mean, max and buckets
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else 0.0,
+            "max": self.max,
+            "buckets": {str(k): self.buckets[k] for k in sorted(self.buckets)},
+        }
+
+
+class NullMetrics:
+    """
+    NullMetrics class, the metrics interface when collection is disabled, every call does nothing
+    """
+    now = 0 #current command tick, set by the TransactionManager
+
+    def lock_granted(self, trans, var):
+        pass
+
+    def lock_blocked(self, trans, var):
+        pass
+
+    def deadlock(self, victim):
+        pass
+
+    def committed(self, trans):
+        pass
+
+    def aborted(self, trans):
+        pass
+
+    def snapshot(self):
+        return {}
+
+
+class Metrics(NullMetrics):
+    """
+    Metrics class, counters and histograms collected by the TransactionManager and sites
+    all durations are in command ticks
+    """
+    def __init__(self):
+        self.now = 0
+        self.grants = collections.Counter() #lock grants {<int:variable>:count}
+        self.blocks = collections.Counter() #lock requests that had to wait {<int:variable>:count}
+        self.blocked_since = dict() #{<str:trans id>:<int:tick it started waiting>}
+        self.wait_ticks = Histogram()
+        self.deadlocks = 0
+        self.victims = []
+        self.commits = 0
+        self.aborts = collections.Counter() #{<str:cause>:count}
+        self.commit_latency = Histogram()
+        self.abort_latency = Histogram()
+
+    def lock_granted(self, trans, var):
+        """
+        a transaction got a lock
+        input: transaction, variable
+        output: None
+        side effect: if the transaction was waiting, its wait time is recorded
+        """
+        self.grants[var] += 1
+        since = self.blocked_since.pop(trans.transid, None)
+        if since is not None:
+            self.wait_ticks.add(self.now - since)
+
+    def lock_blocked(self, trans, var):
+        """
+        a transaction has to wait for a lock
+        input: transaction, variable
+        output: None
+        side effect: None
+        """
+        self.blocks[var] += 1
+        if trans.transid not in self.blocked_since:
+            self.blocked_since[trans.transid] = self.now
+
+    def deadlock(self, victim):
+        """
+        a deadlock was found
+        input: trans id of the victim
+        output: None
+        side effect: None
+        """
+        self.deadlocks += 1
+        self.victims.append(victim)
+
+    def committed(self, trans):
+        """
+        a transaction committed
+        input: transaction
+        output: None
+        side effect: None
+        """
+        self.commits += 1
+        self.commit_latency.add(trans.endtime - trans.time)
+        _ = self.blocked_since.pop(trans.transid, None)
+
+    def aborted(self, trans):
+        """
+        a transaction aborted
+        input: transaction
+        output: None
+        side effect: None
+        """
+        self.aborts[trans.abort_cause] += 1
+        self.abort_latency.add(trans.endtime - trans.time)
+        _ = self.blocked_since.pop(trans.transid, None)
+
+    def snapshot(self):
+        """
+        get all metrics
+        input: None
+        output: dict that can be written as json
+        side effect: None
+        """
+        return {
+            "lock_grants": {str(k): v for k, v in sorted(self.grants.items())},
+            "lock_blocks": {str(k): v for k, v in sorted(self.blocks.items())},
+            "wait_ticks": self.wait_ticks.to_dict(),
+            "deadlocks": self.deadlocks,
+            "deadlock_victims": list(self.victims),
+            "commits": self.commits,
+            "aborts": dict(self.aborts),
+            "commit_latency": self.commit_latency.to_dict(),
+            "abort_latency": self.abort_latency.to_dict(),
+        }
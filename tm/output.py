@@ -0,0 +1,145 @@
+import json
+import sys
+
+
+class NullSink:
+    """
+    NullSink class, output interface of the TransactionManager, drops every event
+    the history details(begin events, where a read came from, what a commit wrote) are
+    only needed by sinks that check the execution, see tm.checker
+    """
+    def began(self, trans_id, kind, time):
+        """
+        input: trans id, "RO", "RW"(two-phase locking) or "SI"(snapshot isolation), begin time
+        """
+        pass
+
+    def read(self, trans_id, var, value, site_id=None, version=None):
+        """
+        input: trans id, variable, value, site read, commit time of the version read
+            (-1 for the initial value, None for the transaction's own write)
+        """
+        pass
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        """
+        input: trans id, commit time(the version of its writes), variables written, sites touched,
+            time is None when the outcome of an ended transaction is given again
+        """
+        pass
+
+    def aborted(self, trans_id, cause):
+        pass
+
+    def site_failed(self, site_id):
+        pass
+
+    def site_recovered(self, site_id):
+        pass
+
+    def dump_site(self, site_id, values):
+        pass
+
+    def dump_var(self, var, values):
+        pass
+
+    def flush(self):
+        pass
+
+
+class TextSink(NullSink):
+    """
+    TextSink class, the human readable output, buffered and written in batches
+    """
+    def __init__(self, stream=None, buffer_size=4096):
+        """
+        input: output stream(stdout by default), number of lines kept before writing
+        output: None
+        side effect: None
+        """
+        self.stream = sys.stdout if stream is None else stream
+        self.buffer_size = buffer_size
+        self.lines = []
+
+    def write(self, line):
+        """
+        add a line to the buffer
+        input: line without newline
+        output: None
+        side effect: the buffer is written when full
+        """
+        self.lines.append(line)
+        if len(self.lines) >= self.buffer_size:
+            self.flush()
+
+    def read(self, trans_id, var, value, site_id=None, version=None):
+        self.write("x{}:{}".format(var, value))
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        self.write("Transaction {} is commited.".format(trans_id))
+
+    def aborted(self, trans_id, cause):
+        self.write("Transaction {} is aborted.".format(trans_id))
+
+    def site_failed(self, site_id):
+        self.write("Site {} fails".format(site_id))
+
+    def site_recovered(self, site_id):
+        self.write("Site {} recovers".format(site_id))
+
+    def dump_site(self, site_id, values):
+        self.write("site {} - {}".format(site_id,
+            ", ".join("x{}: {}".format(var, val) for var, val in values)))
+
+    def dump_var(self, var, values):
+        self.write("x{} -  {}".format(var,
+            "".join("site{}: {}; ".format(i, val) for i, val in values)))
+
+    def flush(self):
+        """
+        write the buffered lines
+        input: None
+        output: None
+        side effect: buffer emptied
+        """
+        if len(self.lines) > 0:
+            self.lines.append("")
+            self.stream.write("\n".join(self.lines))
+            self.lines = []
+        self.stream.flush()
+
+
+class JsonSink(TextSink):
+    """
+    JsonSink class, one json object per event and per line
+    """
+    def began(self, trans_id, kind, time):
+        self.write(json.dumps({"event": "begin", "trans": trans_id, "kind": kind, "time": time}))
+
+    def read(self, trans_id, var, value, site_id=None, version=None):
+        self.write(json.dumps({"event": "read", "trans": trans_id, "var": var, "value": value,
+                               "site": site_id, "version": version}))
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        self.write(json.dumps({"event": "commit", "trans": trans_id, "time": time,
+                               "writes": sorted(writes), "sites": sorted(sites)}))
+
+    def aborted(self, trans_id, cause):
+        self.write(json.dumps({"event": "abort", "trans": trans_id, "cause": cause}))
+
+    def site_failed(self, site_id):
+        self.write(json.dumps({"event": "fail", "site": site_id}))
+
+    def site_recovered(self, site_id):
+        self.write(json.dumps({"event": "recover", "site": site_id}))
+
+    def dump_site(self, site_id, values):
+        self.write(json.dumps({"event": "dump", "site": site_id,
+                               "values": {"x{}".format(var): val for var, val in values}}))
+
+    def dump_var(self, var, values):
+        self.write(json.dumps({"event": "dump", "var": var,
+                               "values": {str(i): val for i, val in values}}))
+
+
+SINKS = {"text": TextSink, "json": JsonSink, "null": NullSink}
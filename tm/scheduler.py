@@ -0,0 +1,145 @@
+import collections
+from trans.op import BEGIN, END, READ, WRITE
+
+
+class Queued:
+    """
+    read-write transaction whose begin is held back, its commands are kept until it is admitted
+    """
+    __slots__ = ("commands", "hot", "complete")
+
+    def __init__(self, command):
+        self.commands = [command]
+        self.hot = False        #one of its commands touches a hot variable
+        self.complete = False   #its end is among the commands
+
+
+class Scheduler():
+    """
+    admission control between a command source and TransactionManager.loadCommand
+    the variables whose lock requests keep waiting(see sites.lock.LockTable.waits) are hot,
+    at most max_hot running read-write transactions may touch hot variables; beyond that the
+    begins of new read-write transactions are queued with the commands that follow them, and
+    admitted when a slot frees up, the ones that have not touched a hot variable first, then
+    in arrival order; a queued transaction whose commands all arrived without touching a hot
+    variable is admitted right away
+    a transaction is only held back before it begins, so it never holds a lock others wait for
+    input: TransactionManager, op record iterator, most read-write transactions on hot variables,
+        decayed lock waits of a hot variable, commands between two updates of the hot variables
+    output: op record iterator
+    side effect: the commands of queued transactions run later than they arrived
+    """
+    def __init__(self, tm, commands, max_hot=2, threshold=2.0, window=64):
+        self.tm = tm
+        self._commands = commands
+        self.max_hot = max_hot
+        self.threshold = threshold
+        self.window = window
+        self.waits = dict()     #lock waits of each variable at the last update {<int:variable>:<int:count>}
+        self.score = dict()     #decayed lock waits per window {<int:variable>:<float:score>}
+        self.hot_vars = set()
+        self.hot = set()        #running read-write transactions that touched a hot variable
+        self.pruned = None      #time the ended transactions were last removed from hot
+        self.queued = collections.OrderedDict() #{<str:trans id>:Queued}, in arrival order
+        self.num_queued = 0     #begins that were queued
+        self.max_queue = 0
+
+    def __iter__(self):
+        queued_list = self.queued
+        window = self.window
+        for count, command in enumerate(self._commands, 1):
+            if count % window == 0:
+                self.update()
+            queued = queued_list.get(command[1]) if len(queued_list) > 0 else None
+            if queued is not None:
+                queued.commands.append(command)
+                if command[0] == END:
+                    queued.complete = True
+                elif command[0] == READ or command[0] == WRITE:
+                    queued.hot = queued.hot or command[2] in self.hot_vars
+                if queued.complete and not queued.hot:
+                    yield from self.admit(command[1])
+                    continue
+            elif command[0] == BEGIN and self.full():
+                queued_list[command[1]] = Queued(command)
+                self.num_queued += 1
+                self.max_queue = max(self.max_queue, len(queued_list))
+            else:
+                self.passed(command)
+                yield command
+            #full() is only called when a slot may have freed up
+            while len(queued_list) > 0 and (len(self.hot) < self.max_hot or self.pruned != self.tm.now) \
+                    and not self.full():
+                yield from self.admit(self.next())
+        #the source is exhausted, nothing frees a slot anymore
+        while len(queued_list) > 0:
+            yield from self.admit(self.next())
+
+    def update(self):
+        """
+        decay the lock waits of the variables and add the waits of the last window
+        input: None
+        output: None
+        side effect: hot_vars updated
+        """
+        hot_vars = set()
+        for var, count in self.tm.locks.waits.items():
+            score = self.score.get(var, 0.0) / 2 + count - self.waits.get(var, 0)
+            self.waits[var] = count
+            self.score[var] = score
+            if score >= self.threshold:
+                hot_vars.add(var)
+        self.hot_vars = hot_vars
+
+    def full(self):
+        """
+        check whether the read-write transactions on hot variables reached the limit
+        input: None
+        output: True/False
+        side effect: ended transactions are forgotten
+        """
+        if len(self.hot) < self.max_hot:
+            return False
+        if self.pruned != self.tm.now:
+            #deadlock victims and failed transactions end before their end command
+            self.pruned = self.tm.now
+            trans_list = self.tm.trans_list
+            self.hot = set(transid for transid in self.hot if transid in trans_list)
+        return len(self.hot) >= self.max_hot
+
+    def next(self):
+        """
+        pick the queued transaction to admit
+        input: None
+        output: trans id, the oldest one that did not touch a hot variable, or else the oldest one
+        side effect: None
+        """
+        for transid, queued in self.queued.items():
+            if not queued.hot:
+                return transid
+        return next(iter(self.queued))
+
+    def admit(self, transid):
+        """
+        release the commands of a queued transaction
+        input: trans id
+        output: op record iterator
+        side effect: the transaction is no longer queued
+        """
+        for command in self.queued.pop(transid).commands:
+            self.passed(command)
+            yield command
+
+    def passed(self, command):
+        """
+        count a read-write transaction touching a hot variable
+        input: op record about to run
+        output: None
+        side effect: None
+        """
+        if command[0] == END:
+            self.hot.discard(command[1])
+        elif (command[0] == READ or command[0] == WRITE) and command[2] in self.hot_vars:
+            trans = self.tm.trans_list.get(command[1])
+            if trans is not None and trans.type == "RW":
+                self.hot.add(command[1])
@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import collections
+from tm.TransManager import TransactionManager, DEADLOCK_POLICIES
+from tm.output import NullSink, TextSink
+from sites.placement import RULES
+from trans.op import BEGIN, BEGIN_RO, END
+from main import commandParser
+
+CLOSE = None #queue item put by a client that disconnected
+
+
+class ClientStream():
+    """
+    stream interface for TextSink, writes to the socket of a client
+    """
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        self.writer.write(text.encode())
+
+    def flush(self):
+        pass
+
+
+class Client():
+    """
+    one connected client: its queue of commands not executed yet and its output
+    """
+    def __init__(self, writer, queue_size):
+        """
+        input: stream writer, most commands queued before the client is not read anymore
+        output: None
+        side effect: None
+        """
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size) #op records, error messages(str) or CLOSE
+        self.sink = TextSink(ClientStream(writer))
+        self.trans = set() #ids of the transactions begun by the client
+        self.scheduled = False
+        self.closed = False
+
+
+class RoutingSink(NullSink):
+    """
+    RoutingSink class, output of the TransactionManager sent to the client owning the
+    transaction, site events and dumps go to the client whose command is running
+    """
+    def __init__(self):
+        self.owner = dict() #{<str:trans id>:Client}
+        self.current = None #client whose commands are running
+        self.dirty = set()  #clients with buffered output
+
+    def sink_of(self, trans_id):
+        """
+        get the sink of the client an event goes to
+        input: trans id, None for site events
+        output: sink
+        side effect: the client is flushed with the next flush
+        """
+        client = self.owner.get(trans_id, self.current)
+        if client is None or client.closed:
+            return NullSink()
+        self.dirty.add(client)
+        return client.sink
+
+    def began(self, trans_id, kind, time):
+        self.sink_of(trans_id).began(trans_id, kind, time)
+
+    def read(self, trans_id, var, value, site_id=None, version=None):
+        self.sink_of(trans_id).read(trans_id, var, value, site_id, version)
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        self.sink_of(trans_id).committed(trans_id, time, writes, sites)
+
+    def aborted(self, trans_id, cause):
+        self.sink_of(trans_id).aborted(trans_id, cause)
+
+    def site_failed(self, site_id):
+        self.sink_of(None).site_failed(site_id)
+
+    def site_recovered(self, site_id):
+        self.sink_of(None).site_recovered(site_id)
+
+    def dump_site(self, site_id, values):
+        self.sink_of(None).dump_site(site_id, values)
+
+    def dump_var(self, var, values):
+        self.sink_of(None).dump_var(var, values)
+
+    def flush(self):
+        for client in self.dirty:
+            client.sink.flush()
+        self.dirty.clear()
+
+
+class Server():
+    """
+    Server class, many clients send commands in the grammar of main.py, one line at a time,
+    their commands are run one batch at a time by a single TransactionManager
+    """
+    def __init__(self, tm, queue_size=256, batch_size=64):
+        """
+        input: TransactionManager(its output is replaced), most commands queued per client,
+            most commands of one client run before the next client gets a turn
+        output: None
+        side effect: None
+        """
+        self.tm = tm
+        self.sink = RoutingSink()
+        tm.set_output(self.sink)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.ready = collections.deque() #clients with queued commands, in turn order
+        self.wakeup = asyncio.Event()
+
+    def schedule(self, client):
+        """
+        give a client a turn if it does not have one
+        input: client
+        output: None
+        side effect: None
+        """
+        if not client.scheduled:
+            client.scheduled = True
+            self.ready.append(client)
+            self.wakeup.set()
+
+    async def handle(self, reader, writer):
+        """
+        read the commands of one client, parsing is done here and running in run()
+        input: stream reader and writer of the connection
+        output: None
+        side effect: None
+        """
+        client = Client(writer, self.queue_size)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    items = commandParser(line.decode())
+                except ValueError as e:
+                    items = ["Error: {}".format(e)]
+                for item in items:
+                    #a full queue stops reading the client
+                    await client.queue.put(item)
+                    self.schedule(client)
+                #a client that does not read its output is not read either
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            await client.queue.put(CLOSE)
+            self.schedule(client)
+
+    async def run(self):
+        """
+        run the queued commands of the clients in turn
+        input: None
+        output: None
+        side effect: None
+        """
+        while True:
+            if len(self.ready) == 0:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            client = self.ready.popleft()
+            items = []
+            while len(items) < self.batch_size and not client.queue.empty():
+                items.append(client.queue.get_nowait())
+            self.execute(client, items)
+            if client.queue.empty():
+                client.scheduled = False
+            else:
+                self.ready.append(client)
+            #let the readers refill the queues
+            await asyncio.sleep(0)
+
+    def execute(self, client, items):
+        """
+        run a batch of one client
+        input: client, queue items
+        output: None
+        side effect: output buffered for the clients is written
+        """
+        self.sink.current = client
+        records = []
+        for item in items:
+            if isinstance(item, tuple):
+                records.append(item)
+                continue
+            self.load(client, records)
+            records = []
+            if item is CLOSE:
+                self.disconnect(client)
+            else:
+                self.error(client, item)
+        self.load(client, records)
+        self.sink.flush()
+        self.sink.current = None
+
+    def load(self, client, records):
+        """
+        run op records, a bad command is reported to the client and skipped
+        input: client, op records
+        output: None
+        side effect: the client owns the transactions it begins
+        """
+        if len(records) == 0:
+            return
+        for record in records:
+            if (record[0] == BEGIN or record[0] == BEGIN_RO) and record[1] not in self.sink.owner:
+                self.sink.owner[record[1]] = client
+                client.trans.add(record[1])
+        commands = iter(records)
+        while True:
+            try:
+                self.tm.loadCommand(commands)
+                return
+            except ValueError as e:
+                self.error(client, "Error: {}".format(e))
+            except KeyError as e:
+                self.error(client, "Error: unknown transaction {}".format(e))
+            except Exception as e:
+                #the other clients keep being served
+                self.error(client, "Error: {}: {}".format(type(e).__name__, e))
+
+    def error(self, client, message):
+        """
+        report a bad command to its client
+        input: client, error line
+        output: None
+        side effect: the client is flushed with the batch
+        """
+        client.sink.write(message)
+        self.sink.dirty.add(client)
+
+    def disconnect(self, client):
+        """
+        abort the running transactions of a client that disconnected
+        input: client
+        output: None
+        side effect: the connection is closed
+        """
+        client.closed = True
+        ends = []
+        for trans_id in sorted(client.trans):
+            trans = self.tm.trans_list.get(trans_id)
+            if trans is not None and trans.endtime is None:
+                trans.set_abort("client disconnected")
+                ends.append((END, trans_id, None, None))
+            del self.sink.owner[trans_id]
+        self.load(client, ends)
+        #the output buffered before the disconnect is still sent
+        client.sink.flush()
+        self.sink.dirty.discard(client)
+        client.writer.close()
+
+    async def serve(self, host="127.0.0.1", port=0, path=None):
+        """
+        listen on a TCP port, or a Unix socket if a path is given
+        input: host, port(0 for any free port), socket path
+        output: asyncio server, already accepting clients
+        side effect: the command loop is started
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        self.runner = asyncio.ensure_future(self.run())
+        return server
+
+
+async def serve_forever(server, host, port, path):
+    listener = await server.serve(host, port, path)
+    for sock in listener.sockets:
+        print("listening on {}".format(sock.getsockname()))
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    description = "Serve the transaction manager to many clients"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--host', default='127.0.0.1',
+			help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=7000,
+			help='TCP port to listen on.')
+    parser.add_argument('--unix',
+			dest='path',
+			help='Listen on this Unix socket instead of TCP.')
+    parser.add_argument('--queue', type=int, default=256,
+			help='Most commands queued per client before it is not read anymore.')
+    parser.add_argument('--batch', type=int, default=64,
+			help='Most commands of one client run in one turn.')
+    parser.add_argument('--sites',
+			dest='num_sites', type=int, default=10,
+			help='Number of sites.')
+    parser.add_argument('--variables',
+			dest='num_vars', type=int, default=20,
+			help='Number of variables.')
+    parser.add_argument('--replication',
+			dest='replication', default='default', choices=sorted(RULES),
+			help='Which variables are stored in which sites.')
+    parser.add_argument('--history',
+			dest='history', type=int, default=100000,
+			help='Most outcomes of finished transactions kept to reject reused transaction ids.')
+    parser.add_argument('--deadlock',
+			dest='deadlock', default='detect', choices=DEADLOCK_POLICIES,
+			help='Deadlock policy: detect cycles, wait-die or wound-wait.')
+    args = parser.parse_args()
+    tm = TransactionManager(args.num_sites, args.num_vars, args.replication,
+                            deadlock=args.deadlock, history=args.history)
+    server = Server(tm, args.queue, args.batch)
+    try:
+        asyncio.run(serve_forever(server, args.host, args.port, args.path))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__=='__main__':
+    main()
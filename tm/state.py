@@ -0,0 +1,82 @@
+try:
+    import numpy as np
+except ImportError: #only the columnar state needs numpy
+    np = None
+
+
+class ClusterState:
+    """
+    ClusterState class, committed state of all sites as sites x variables arrays,
+    row i-1 is site i and column v-1 is variable v
+    """
+    def __init__(self, values, present, readable, up):
+        """
+        input: int64 values, bool mask of the copies stored in each site,
+            bool mask of the copies that can be read(site up and read_available), bool site up
+        output: None
+        side effect: None
+        """
+        self.values = values       #absent copies are 0
+        self.present = present
+        self.readable = readable
+        self.up = up               #up[i-1] is True if site i is up
+
+    def disagreements(self):
+        """
+        find the variables whose readable copies do not all hold the same value
+        input: None
+        output: array of variables
+        side effect: None
+        """
+        info = np.iinfo(np.int64)
+        high = np.where(self.readable, self.values, info.min).max(axis=0)
+        low = np.where(self.readable, self.values, info.max).min(axis=0)
+        readable = self.readable.any(axis=0)
+        return np.flatnonzero(readable & (high != low)) + 1
+
+    def save(self, path):
+        """
+        write the state in one write: a .csv table(one row per site, absent copies empty),
+        a .npy file of the values only, or an .npz archive of all arrays otherwise
+        input: path
+        output: None
+        side effect: None
+        """
+        if path.endswith(".csv"):
+            num_sites, num_vars = self.values.shape
+            cells = np.where(self.present, self.values.astype(str), "")
+            header = ",".join(["site", "up"] + ["x{}".format(v) for v in range(1, num_vars+1)])
+            rows = [",".join([str(i+1), "1" if self.up[i] else "0"] + cells[i].tolist())
+                    for i in range(num_sites)]
+            with open(path, "w") as f:
+                f.write("\n".join([header] + rows) + "\n")
+        elif path.endswith(".npy"):
+            np.save(path, self.values)
+        else:
+            np.savez(path, values=self.values, present=self.present, readable=self.readable, up=self.up)
+
+
+def cluster_state(site_list, num_vars):
+    """
+    collect the committed state of the sites, one bulk copy of the arrays of each site
+    input: site list of the TransactionManager(site 0 is not a real site), number of variables
+    output: ClusterState
+    side effect: ImportError without numpy
+    """
+    if np is None:
+        raise ImportError("The columnar cluster state needs numpy.")
+    num_sites = len(site_list) - 1
+    values = np.zeros((num_sites, num_vars), dtype=np.int64)
+    present = np.zeros((num_sites, num_vars), dtype=bool)
+    readable = np.zeros((num_sites, num_vars), dtype=bool)
+    up = np.zeros(num_sites, dtype=bool)
+    for site in site_list[1:]:
+        row = site.siteid - 1
+        var_ids, site_values, read_available = site.columns()
+        cols = np.asarray(var_ids, dtype=np.intp) - 1
+        values[row, cols] = np.frombuffer(site_values, dtype=np.int64)
+        present[row, cols] = True
+        up[row] = site.status == "ON"
+        if up[row]:
+            readable[row, cols] = np.frombuffer(read_available, dtype=np.uint8) != 0
+    return ClusterState(values, present, readable, up)
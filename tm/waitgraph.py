@@ -0,0 +1,180 @@
+class NullWaitGraph:
+    """
+    NullWaitGraph class, keeps no wait-for edges, for the deadlock prevention policies
+    that never let a cycle form(see sites.lock.LockTable.prevent)
+    """
+    def add_node(self, waiter):
+        pass
+
+    def add_edge(self, waiter, holder):
+        pass
+
+    def set_edges(self, waiter, holders):
+        pass
+
+    def edges(self, waiter):
+        return set()
+
+    def remove_node(self, transid):
+        """
+        output: no waiter, the TransactionManager wakes the queues of the locks it held instead
+        """
+        return []
+
+    def new_edges(self):
+        return []
+
+    def cycle_members(self):
+        return set()
+
+
+class WaitForGraph:
+    """
+    Wait-for graph between transactions, kept up to date as locks are
+    requested and released instead of being rebuilt for every deadlock check
+    """
+    def __init__(self):
+        """
+        create an empty graph
+        input: None
+        output: None
+        side effect: None
+        """
+        self.out_edges = dict() #{<str:waiter id>:set(<str:holder id>)}
+        self.in_edges = dict()  #{<str:holder id>:set(<str:waiter id>)}
+        self.order = dict()     #{<str:waiter id>:<int:first time it blocked>}
+        self.pending = []       #edges added since the last check, [(waiter, holder)]
+        self.counter = 0
+
+    def add_node(self, waiter):
+        """
+        register a blocked transaction
+        input: waiter id
+        output: None
+        side effect: waiter gets an (empty) entry in out_edges
+        """
+        if waiter not in self.out_edges:
+            self.out_edges[waiter] = set()
+            self.order[waiter] = self.counter
+            self.counter += 1
+
+    def add_edge(self, waiter, holder):
+        """
+        waiter waits for holder
+        input: waiter id, holder id
+        output: None
+        side effect: edge added and remembered for the next cycle check
+        """
+        self.add_node(waiter)
+        if holder in self.out_edges[waiter]:
+            return
+        self.out_edges[waiter].add(holder)
+        if holder not in self.in_edges:
+            self.in_edges[holder] = set()
+        self.in_edges[holder].add(waiter)
+        self.pending.append((waiter, holder))
+
+    def set_edges(self, waiter, holders):
+        """
+        replace everything waiter waits for
+        input: waiter id, iterable of holder ids
+        output: None
+        side effect: old out edges of waiter are dropped, new ones added
+        """
+        self.add_node(waiter)
+        for holder in self.out_edges[waiter]:
+            self.in_edges[holder].discard(waiter)
+        self.out_edges[waiter] = set()
+        for holder in list(holders):
+            self.add_edge(waiter, holder)
+
+    def edges(self, waiter):
+        """
+        get the transactions waiter waits for
+        input: waiter id
+        output: set of holder ids
+        side effect: None
+        """
+        return self.out_edges.get(waiter, set())
+
+    def remove_node(self, transid):
+        """
+        drop a finished transaction from the graph
+        input: trans id
+        output: ids of waiters that no longer wait for anyone, in the order they first blocked
+        side effect: all edges from and to transid are removed
+        """
+        resume_list = []
+        for waiter in self.in_edges.pop(transid, set()):
+            if waiter == transid:
+                continue
+            holders = self.out_edges[waiter]
+            holders.discard(transid)
+            if len(holders) == 0:
+                resume_list.append(waiter)
+        for holder in self.out_edges.pop(transid, set()):
+            if holder != transid:
+                self.in_edges[holder].discard(transid)
+        self.order.pop(transid, None)
+        resume_list.sort(key=self.order.__getitem__)
+        return resume_list
+
+    def new_edges(self):
+        """
+        take the edges added since the last check
+        input: None
+        output: list of (waiter id, holder id), some may have been removed since
+        side effect: pending edges are forgotten
+        """
+        pending = self.pending
+        self.pending = []
+        return pending
+
+    def cycle_members(self):
+        """
+        find the transactions on cycles that go through edges added since the last check
+        input: None
+        output: set of trans ids
+        side effect: pending edges that are not on a cycle are forgotten
+        """
+        members = set()
+        still_pending = []
+        for waiter, holder in self.pending:
+            if holder not in self.out_edges.get(waiter, ()):
+                continue
+            if waiter in members and holder in members:
+                still_pending.append((waiter, holder))
+                continue
+            cycle = self.cycle_through(waiter, holder)
+            if len(cycle) != 0:
+                members.update(cycle)
+                still_pending.append((waiter, holder))
+        self.pending = still_pending
+        return members
+
+    def cycle_through(self, waiter, holder):
+        """
+        find every transaction on a cycle through edge waiter -> holder
+        input: waiter id, holder id
+        output: set of trans ids, empty if there is no such cycle
+        side effect: None
+        """
+        reach = set([holder])
+        stack = [holder]
+        while len(stack) > 0:
+            node = stack.pop()
+            for nxt in self.out_edges.get(node, ()):
+                if nxt not in reach:
+                    reach.add(nxt)
+                    stack.append(nxt)
+        if waiter not in reach:
+            return set()
+        cycle = set([waiter])
+        stack = [waiter]
+        while len(stack) > 0:
+            node = stack.pop()
+            for prev in self.in_edges.get(node, ()):
+                if prev in reach and prev not in cycle:
+                    cycle.add(prev)
+                    stack.append(prev)
+        return cycle
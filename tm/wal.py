@@ -0,0 +1,415 @@
+import array
+import collections
+import mmap
+import os
+import struct
+from tm.output import NullSink
+
+#log record header: record type, tick, number of writes(commit) or site id(fail/recover)
+RECORD = struct.Struct("<BqI")
+#one write of a commit record: site id, variable, value
+WRITE = struct.Struct("<iiq")
+COMMIT, FAIL, RECOVER = range(3)
+
+SNAPSHOT_MAGIC = b"ADBSNAP1"
+#snapshot header: tick, number of sites, number of variables
+SNAPSHOT_HEADER = struct.Struct("<8sqqq")
+#site header: status(1 ON, 0 OFF), number of variables, number of version chains, number of versions
+SITE_HEADER = struct.Struct("<qqqq")
+
+
+class NullLog:
+    """
+    NullLog class, durability interface of the TransactionManager, nothing is kept
+    """
+    def committed(self, trans, site_list):
+        pass
+
+    def site_failed(self, tick, site_id):
+        pass
+
+    def site_recovered(self, tick, site_id):
+        pass
+
+    def tick(self, now):
+        pass
+
+    def durable(self, output):
+        """
+        get the sink the TransactionManager gives its output to
+        input: sink
+        output: the same sink, a commit is durable once it is given
+        """
+        return output
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DurableSink(NullSink):
+    """
+    DurableSink class, holds the output of a TransactionManager while commits are logged but
+    not synced: a commit is only reported once its group is, the events after it are held
+    too so the output keeps its order
+    """
+    def __init__(self, output, log):
+        """
+        input: sink the events are given to, CommitLog
+        output: None
+        side effect: None
+        """
+        self.output = output
+        self.log = log
+        self.events = collections.deque() #[(<function:method of output>, args)]
+
+    def hold(self, method, args):
+        """
+        give an event to the output, or hold it until the log is synced
+        input: method of the output, its arguments
+        output: None
+        side effect: None
+        """
+        if len(self.events) == 0 and self.log.pending_commits == 0:
+            method(*args)
+        else:
+            self.events.append((method, args))
+
+    def release(self):
+        """
+        give the held events to the output, called once the pending records are synced
+        input: None
+        output: None
+        side effect: None
+        """
+        events = self.events
+        while len(events) > 0:
+            method, args = events.popleft()
+            method(*args)
+
+    def began(self, trans_id, kind, time):
+        self.hold(self.output.began, (trans_id, kind, time))
+
+    def read(self, trans_id, var, value, site_id=None, version=None):
+        self.hold(self.output.read, (trans_id, var, value, site_id, version))
+
+    def committed(self, trans_id, time=None, writes=(), sites=()):
+        self.hold(self.output.committed, (trans_id, time, writes, sites))
+
+    def aborted(self, trans_id, cause):
+        self.hold(self.output.aborted, (trans_id, cause))
+
+    def site_failed(self, site_id):
+        self.hold(self.output.site_failed, (site_id,))
+
+    def site_recovered(self, site_id):
+        self.hold(self.output.site_recovered, (site_id,))
+
+    def dump_site(self, site_id, values):
+        self.hold(self.output.dump_site, (site_id, values))
+
+    def dump_var(self, var, values):
+        self.hold(self.output.dump_var, (var, values))
+
+    def flush(self):
+        """
+        flush the output, the held events stay held until the log is synced
+        """
+        self.output.flush()
+
+
+class CommitLog(NullLog):
+    """
+    CommitLog class, write-ahead log of commits and site failures with group commit,
+    plus periodic snapshots of the committed state of all sites
+    files in the directory: commit.log(binary records) and snapshot.bin(see write_snapshot)
+    """
+    def __init__(self, directory, group_commits=1, group_ticks=0, checkpoint_ticks=0):
+        """
+        input: directory of the log, number of commits per fsync, number of ticks a commit
+            may wait for its fsync(0 for no limit), ticks between snapshots(0 for never)
+        output: None
+        side effect: the directory is created if needed
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, "commit.log")
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.group_commits = group_commits
+        self.group_ticks = group_ticks
+        self.checkpoint_ticks = checkpoint_ticks
+        self.pending = bytearray() #records not written yet
+        self.pending_commits = 0   #commit records among them
+        self.first_pending = -1    #tick of the oldest record not written yet
+        self.last_checkpoint = -1  #tick covered by the snapshot
+        self.valid_size = None     #size of the complete records of the log, known after restore
+        self.file = None
+        self.sink = None           #DurableSink of the output, released on every sync
+
+    def open(self):
+        """
+        open the log for appending, a torn record at the end is cut off
+        input: None
+        output: None
+        side effect: None
+        """
+        if self.file is None:
+            self.file = open(self.log_path, "ab")
+            if self.valid_size is not None:
+                self.file.truncate(self.valid_size)
+
+    def append(self, record, tick, commit=False):
+        """
+        add a record to the group, only commit records count towards a full group:
+        a fail/recover record is written with the next commit, before any commit that follows it
+        input: record bytes, tick, True for a commit record
+        output: None
+        side effect: the group is written and synced when full or too old
+        """
+        self.pending += record
+        if commit:
+            self.pending_commits += 1
+        if self.first_pending == -1:
+            self.first_pending = tick
+        if self.pending_commits >= self.group_commits:
+            self.flush()
+        else:
+            self.tick(tick)
+
+    def tick(self, now):
+        """
+        write the group once its oldest record waited group_ticks, called for every command
+        so that a group is not held until the next record comes
+        input: current tick
+        output: None
+        side effect: None
+        """
+        if self.group_ticks > 0 and self.first_pending != -1 and now - self.first_pending >= self.group_ticks:
+            self.flush()
+
+    def durable(self, output):
+        """
+        get the sink the TransactionManager gives its output to
+        input: sink
+        output: DurableSink, a commit is given to the sink once its record is synced
+        side effect: the DurableSink replaces the one of an earlier output
+        """
+        self.sink = DurableSink(output, self)
+        return self.sink
+
+    def committed(self, trans, site_list):
+        """
+        log the writes of a committing transaction, before they are applied
+        input: transaction, site list of the TransactionManager
+        output: None
+        side effect: a snapshot is taken first when one is due
+        """
+        tick = trans.endtime
+        if self.checkpoint_ticks > 0 and tick - self.last_checkpoint >= self.checkpoint_ticks:
+            #the commit is not applied yet, the snapshot covers every earlier tick
+            self.checkpoint(tick - 1, site_list)
+        writes = []
+        for i in sorted(trans.sites):
+            for var, value in site_list[i].buffer.get(trans.transid, {}).items():
+                writes.append(WRITE.pack(i, var, value))
+        self.append(RECORD.pack(COMMIT, tick, len(writes)) + b"".join(writes), tick, True)
+
+    def site_failed(self, tick, site_id):
+        self.append(RECORD.pack(FAIL, tick, site_id), tick)
+
+    def site_recovered(self, tick, site_id):
+        self.append(RECORD.pack(RECOVER, tick, site_id), tick)
+
+    def flush(self):
+        """
+        write and sync the pending records
+        input: None
+        output: None
+        side effect: None
+        """
+        if len(self.pending) == 0:
+            return
+        self.open()
+        self.file.write(self.pending)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = bytearray()
+        self.pending_commits = 0
+        self.first_pending = -1
+        if self.sink is not None:
+            self.sink.release()
+
+    def close(self):
+        """
+        flush and close the log
+        input: None
+        output: None
+        side effect: None
+        """
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def checkpoint(self, tick, site_list):
+        """
+        snapshot the committed state and empty the log
+        input: last tick whose effects are all applied, site list
+        output: None
+        side effect: pending records are dropped, the snapshot holds their effects
+        """
+        write_snapshot(self.snapshot_path, tick, site_list)
+        self.pending = bytearray()
+        self.pending_commits = 0
+        self.first_pending = -1
+        self.open()
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.valid_size = 0
+        self.last_checkpoint = tick
+        if self.sink is not None:
+            #the snapshot holds the pending commits
+            self.sink.release()
+
+    def restore(self, tm):
+        """
+        rebuild the committed state of a fresh TransactionManager: load the snapshot,
+        then replay the log records after it
+        input: TransactionManager
+        output: number of log records replayed
+        side effect: tm.now is set to the last restored tick
+        """
+        tick = -1
+        if os.path.exists(self.snapshot_path):
+            tick = read_snapshot(self.snapshot_path, tm.site_list)
+        self.last_checkpoint = tick
+        tm.now = max(tm.now, tick)
+        replayed = 0
+        self.valid_size = 0
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0:
+            with open(self.log_path, "rb") as f:
+                log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    replayed = self.replay(log, tick, tm)
+                finally:
+                    log.close()
+        tm.replicas.reset(tm.site_list)
+        return replayed
+
+    def replay(self, log, after, tm):
+        """
+        apply the complete log records newer than a tick
+        input: log bytes, tick covered by the snapshot, TransactionManager
+        output: number of records applied
+        side effect: valid_size is the size of the complete records
+        """
+        replayed = 0
+        pos = 0
+        while pos + RECORD.size <= len(log):
+            kind, tick, count = RECORD.unpack_from(log, pos)
+            end = pos + RECORD.size
+            if kind == COMMIT:
+                end += count * WRITE.size
+            if end > len(log):
+                #torn record, it was never synced
+                break
+            if tick > after:
+                if kind == COMMIT:
+                    for i, var, value in WRITE.iter_unpack(log[pos + RECORD.size:end]):
+                        _ = tm.site_list[i].apply(var, tick, value, tick)
+                elif kind == FAIL:
+                    tm.site_list[count].failed()
+                else:
+                    tm.site_list[count].recovered()
+                tm.now = max(tm.now, tick)
+                replayed += 1
+            pos = end
+        self.valid_size = pos
+        return replayed
+
+
+def write_snapshot(path, tick, site_list):
+    """
+    write the committed state of every site, as little endian int64 fields:
+    snapshot header, then for each site: site header, values, read_available
+    (one byte per variable, padded to 8 bytes), variables with versions, number of
+    versions of each, then the commit times and the values of all versions
+    the file is written to a temporary name and renamed, a crash keeps the old snapshot
+    input: path, tick, site list
+    output: None
+    side effect: None
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, tick, len(site_list) - 1,
+                                     site_list[0].placement.num_vars))
+        for site in site_list[1:]:
+            chain_vars = array.array("q", site.versions)
+            lengths = array.array("q")
+            times = array.array("q")
+            values = array.array("q")
+            for var in chain_vars:
+                chain_times, chain_values = site.versions[var]
+                lengths.append(len(chain_times))
+                times.extend(chain_times)
+                values.extend(chain_values)
+            f.write(SITE_HEADER.pack(1 if site.status == "ON" else 0, len(site.values),
+                                     len(chain_vars), len(times)))
+            f.write(site.values.tobytes())
+            f.write(bytes(site.read_available))
+            f.write(bytes(-len(site.read_available) % 8))
+            for part in (chain_vars, lengths, times, values):
+                f.write(part.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_int64(snap, pos, n):
+    """
+    read int64 fields of a snapshot
+    input: snapshot bytes, offset, number of fields
+    output: array, offset after the fields
+    side effect: None
+    """
+    fields = array.array("q")
+    fields.frombytes(snap[pos:pos + 8*n])
+    return fields, pos + 8*n
+
+def read_snapshot(path, site_list):
+    """
+    load a snapshot written by write_snapshot into fresh sites of the same layout
+    input: path, site list
+    output: tick of the snapshot
+    side effect: site values, availability, versions and status are replaced
+    """
+    with open(path, "rb") as f:
+        snap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, tick, num_sites, num_vars = SNAPSHOT_HEADER.unpack_from(snap, 0)
+        if magic != SNAPSHOT_MAGIC or num_sites != len(site_list) - 1 or \
+                num_vars != site_list[0].placement.num_vars:
+            raise ValueError("Snapshot {} does not match the sites.".format(path))
+        pos = SNAPSHOT_HEADER.size
+        for site in site_list[1:]:
+            status, n, chains, total = SITE_HEADER.unpack_from(snap, pos)
+            pos += SITE_HEADER.size
+            site.values, pos = read_int64(snap, pos, n)
+            site.read_available = bytearray(snap[pos:pos + n])
+            pos += n + (-n % 8)
+            chain_vars, pos = read_int64(snap, pos, chains)
+            lengths, pos = read_int64(snap, pos, chains)
+            times, pos = read_int64(snap, pos, total)
+            values, pos = read_int64(snap, pos, total)
+            times = times.tolist()
+            values = values.tolist()
+            site.versions = dict()
+            start = 0
+            for var, length in zip(chain_vars, lengths):
+                site.versions[var] = (times[start:start + length], values[start:start + length])
+                start += length
+            site.status = "ON" if status == 1 else "OFF"
+        return tick
+    finally:
+        snap.close()
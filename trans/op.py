@@ -1,7 +1,19 @@
+#opcodes of parsed commands, a command is a record (opcode, trans id, variable, value)
+#fail and recover carry the site id in the value field
+BEGIN, BEGIN_RO, END, FAIL, RECOVER, DUMP, READ, WRITE = range(8)
+OPCODES = {"begin": BEGIN, "beginRO": BEGIN_RO, "end": END, "fail": FAIL,
+           "recover": RECOVER, "dump": DUMP, "R": READ, "W": WRITE}
+#values are int64 in the sites, traces and the commit log, variables and site ids are
+#at most int32 there
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+ID_MAX = 2**31 - 1
+
 class Op:
     """
     Operation class
     """
+    __slots__ = ("op_type", "var", "value", "transaction")
+
     def __init__(self, op_type, var, transaction, value=None):
         self.op_type = op_type
         self.var = var
@@ -0,0 +1,167 @@
+import argparse
+import mmap
+import os
+import struct
+from trans.op import READ, WRITE, FAIL, RECOVER
+
+#trace file: header, fixed-width op records, then the table of transaction ids
+#header: magic, number of records, offset of the id table
+HEADER = struct.Struct("<8sqq")
+TRACE_MAGIC = b"ADBTRACE"
+#op record: opcode, trans id index(0 for none, i for the i-th id of the table), variable(0 for none), value
+RECORD = struct.Struct("<BIIq")
+#id table: number of ids, size of the ids joined by newlines
+TABLE = struct.Struct("<qq")
+CHUNK = 65536 #records decoded at a time
+
+#fields of the op records that are not None, by opcode
+HAS_VAR = frozenset((READ, WRITE))
+HAS_VALUE = frozenset((WRITE, FAIL, RECOVER))
+
+
+class TraceWriter:
+    """
+    TraceWriter class, records op records into a trace file
+    """
+    def __init__(self, path):
+        """
+        input: path of the trace file
+        output: None
+        side effect: the file is created, it is complete only after close()
+        """
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(TRACE_MAGIC, 0, 0))
+        self.ids = dict() #interned trans ids {<str:trans id>:<int:index>}
+        self.count = 0
+        self.pending = bytearray()
+
+    def write(self, command):
+        """
+        append an op record
+        input: op record (opcode, trans id, variable, value), see trans.op
+        output: None
+        side effect: None
+        """
+        opcode, transid, var, value = command
+        index = 0
+        if transid is not None:
+            index = self.ids.get(transid)
+            if index is None:
+                index = len(self.ids) + 1
+                self.ids[transid] = index
+        self.pending += RECORD.pack(opcode, index, 0 if var is None else var,
+                                    0 if value is None else value)
+        self.count += 1
+        if len(self.pending) >= CHUNK * RECORD.size:
+            self.file.write(self.pending)
+            self.pending = bytearray()
+
+    def close(self):
+        """
+        write the id table and the header
+        input: None
+        output: None
+        side effect: the file is closed
+        """
+        self.file.write(self.pending)
+        self.pending = bytearray()
+        table_offset = self.file.tell()
+        blob = "\n".join(self.ids).encode()
+        self.file.write(TABLE.pack(len(self.ids), len(blob)))
+        self.file.write(blob)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(TRACE_MAGIC, self.count, table_offset))
+        self.file.close()
+
+
+class recorder():
+    """
+    record the op records of an iterator while they are consumed
+    input: op record iterator, trace path
+    output: op record iterator
+    side effect: the trace is complete when the iterator is exhausted or closed
+    """
+    def __init__(self, commands, path):
+        self._commands = commands
+        self._path = path
+
+    def __iter__(self):
+        writer = TraceWriter(self._path)
+        try:
+            for command in self._commands:
+                writer.write(command)
+                yield command
+        finally:
+            writer.close()
+
+
+class traceReader():
+    """
+    trace reader, the file is mapped in memory and decoded a chunk at a time
+    input: trace path
+    output: op record iterator
+    side effect: None
+    """
+    def __init__(self, path):
+        self._path = path
+
+    def __iter__(self):
+        with open(self._path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError("{} is not a complete trace.".format(self._path))
+            trace = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(trace)
+        chunk = None
+        records = None
+        try:
+            magic, count, table_offset = HEADER.unpack_from(view, 0)
+            if magic != TRACE_MAGIC or table_offset != HEADER.size + count * RECORD.size:
+                raise ValueError("{} is not a complete trace.".format(self._path))
+            num_ids, size = TABLE.unpack_from(view, table_offset)
+            blob = bytes(view[table_offset + TABLE.size:table_offset + TABLE.size + size])
+            ids = [None] + (blob.decode().split("\n") if num_ids > 0 else [])
+            has_var = HAS_VAR
+            has_value = HAS_VALUE
+            for start in range(HEADER.size, table_offset, CHUNK * RECORD.size):
+                #records are unpacked straight from the mapped file, without a copy
+                chunk = view[start:min(start + CHUNK * RECORD.size, table_offset)]
+                records = RECORD.iter_unpack(chunk)
+                for opcode, index, var, value in records:
+                    yield (opcode, ids[index], var if opcode in has_var else None,
+                           value if opcode in has_value else None)
+                records = None
+                chunk.release()
+        finally:
+            #the views must be released before the map is closed, also when the reader stops early
+            records = None
+            if chunk is not None:
+                chunk.release()
+            view.release()
+            trace.close()
+
+
+def convert(text_path, trace_path):
+    """
+    convert a command file to a trace
+    input: command file path, trace path
+    output: number of op records
+    side effect: None
+    """
+    from main import fileReader
+    writer = TraceWriter(trace_path)
+    for command in fileReader(text_path):
+        writer.write(command)
+    writer.close()
+    return writer.count
+
+def main():
+    description = "Convert a command file to a binary trace"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('text', help='Command file.')
+    parser.add_argument('trace', help='Trace file to write.')
+    args = parser.parse_args()
+    print("{} records".format(convert(args.text, args.trace)))
+
+
+if __name__=='__main__':
+    main()
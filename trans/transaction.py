@@ -1,18 +1,31 @@
+import collections
 from trans.op import Op
 class Transaction:
     """
     Transaction class
     Author: Yiming Li & Xinsen Lu
     """
+    RUNNING = "RUNNING"
+    BLOCKED = "BLOCKED"
+    COMMITTED = "COMMITTED"
+    ABORTED = "ABORTED"
+    ALL_STATUS = (RUNNING, BLOCKED, COMMITTED, ABORTED)
+
+    __slots__ = ("transid", "type", "status", "ifabort", "time", "endtime", "op",
+                 "sites", "waiting", "abort_cause", "writes")
+
     def __init__(self, ID, trans_type, time):
         self.transid = ID       #T1, T2, ...
         self.type = trans_type  #RW, RO
-        self.status = "RUNNING"
+        self.status = Transaction.RUNNING
         self.ifabort = False
         self.time = time
         self.endtime = None
         self.op = None
-        self.allstatus = ["RUNNING","BLOCKED","COMMITTED"]
+        self.sites = set()      #sites where the transaction holds locks or buffered writes
+        self.waiting = None     #variable whose wait queue the transaction is in
+        self.abort_cause = None #why ifabort was set: "site failure", "deadlock", "no available copy"
+        self.writes = set()     #variables written
 
 
     def update_op(self, op):
@@ -25,6 +38,20 @@ class Transaction:
         """
         self.op = op
 
+    def set_op(self, op_type, var, value=None):
+        """
+        set the current operation, the Op object of the transaction is reused
+        input: op type("R"/"W"), variable, value
+        output: None
+        side effect: change operation
+        """
+        if self.op is None:
+            self.op = Op(op_type, var, self.transid, value)
+        else:
+            self.op.op_type = op_type
+            self.op.var = var
+            self.op.value = value
+
     def get_status(self):
         """
         get transaction status
@@ -43,5 +70,89 @@ class Transaction:
         output: None
         side effect: transaction status changed
         """
-        if newstatus in self.allstatus:
+        if newstatus in Transaction.ALL_STATUS:
             self.status = newstatus
+
+    def set_abort(self, cause):
+        """
+        mark the transaction to abort when it ends
+        input: cause(string)
+        output: None
+        side effect: ifabort is set, the first cause is kept
+        """
+        self.ifabort = True
+        if self.abort_cause is None:
+            self.abort_cause = cause
+
+
+class Outcome:
+    """
+    Outcome class, what is kept of a transaction after it ends
+    """
+    __slots__ = ("transid", "status", "endtime", "abort_cause")
+
+    def __init__(self, ID, status, endtime, abort_cause):
+        self.transid = ID
+        self.status = status    #COMMITTED, ABORTED
+        self.endtime = endtime
+        self.abort_cause = abort_cause
+
+
+class History:
+    """
+    History class, outcomes of the finished transactions in end order,
+    the oldest ones are forgotten beyond a limit; a transaction that ended before its end
+    command(deadlock victim, failed site) still gets commands, its outcome is only counted
+    against the limit once the end command came
+    """
+    def __init__(self, limit=None):
+        """
+        input: most outcomes kept, None for no limit
+        output: None
+        side effect: None
+        """
+        self.limit = limit
+        self.outcomes = collections.OrderedDict() #{<str:trans id>:Outcome}
+        self.open = dict() #outcomes waiting for the end command {<str:trans id>:Outcome}
+
+    def __len__(self):
+        return len(self.outcomes) + len(self.open)
+
+    def __contains__(self, transid):
+        return transid in self.outcomes or transid in self.open
+
+    def get(self, transid):
+        """
+        get the outcome of a finished transaction
+        input: trans id
+        output: Outcome, None if unknown or forgotten
+        side effect: None
+        """
+        outcome = self.open.get(transid)
+        if outcome is None:
+            outcome = self.outcomes.get(transid)
+        return outcome
+
+    def add(self, trans):
+        """
+        keep the outcome of a transaction that ended
+        input: transaction
+        output: None
+        side effect: the outcome is kept until close() is called for it
+        """
+        status = Transaction.ABORTED if trans.ifabort else Transaction.COMMITTED
+        self.open[trans.transid] = Outcome(trans.transid, status, trans.endtime, trans.abort_cause)
+
+    def close(self, transid):
+        """
+        the end command of a finished transaction came, no more commands are expected for it
+        input: trans id
+        output: None
+        side effect: the oldest outcome is forgotten when over the limit
+        """
+        outcome = self.open.pop(transid, None)
+        if outcome is None:
+            return
+        self.outcomes[transid] = outcome
+        if self.limit is not None and len(self.outcomes) > self.limit:
+            _ = self.outcomes.popitem(last=False)